@@ -0,0 +1,67 @@
+import logging
+import threading
+from queue import Queue
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+import constants as c
+
+logger = logging.getLogger(__name__)
+
+
+class ChatDispatcher(Dispatcher):
+    """Dispatcher processing the updates of different chats in parallel.
+    Every chat is assigned to one worker thread, so the updates of a chat
+    are still processed one after the other and in the order they arrived"""
+
+    def __init__(self, *args, chat_workers=c.CHAT_WORKERS, **kwargs):
+        """
+        :param chat_workers: Number of threads processing updates
+        All other arguments are passed to the Dispatcher
+        """
+        super().__init__(*args, **kwargs)
+        self.chat_queues = [Queue() for _ in range(chat_workers)]
+        self.chat_threads = []
+
+    def start(self, ready=None):
+        """Start the chat workers and then the dispatcher thread"""
+        if len(self.chat_threads) == 0:
+            for idx, queue in enumerate(self.chat_queues):
+                thread = threading.Thread(target=self.run_chat_worker, args=(queue,),
+                                          name="chat_worker_{}".format(idx), daemon=True)
+                thread.start()
+                self.chat_threads.append(thread)
+        super().start(ready)
+
+    def stop(self):
+        """Stop the dispatcher thread and the chat workers after their queued updates"""
+        super().stop()
+        for queue in self.chat_queues:
+            queue.put(None)
+        for thread in self.chat_threads:
+            thread.join()
+        self.chat_threads = []
+
+    def process_update(self, update):
+        """Hand the update to the worker of its chat. Updates without
+        a chat and errors are processed directly"""
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None or len(self.chat_threads) == 0:
+            super().process_update(update)
+            return
+        self.chat_queues[chat.id % len(self.chat_queues)].put(update)
+
+    def run_chat_worker(self, queue: Queue):
+        """Thread target: process the updates of the chats assigned to this worker"""
+        while True:
+            update = queue.get()
+            if update is None:
+                break
+            try:
+                super().process_update(update)
+            except Exception as e:
+                # process_update already hands handler errors to the error handlers
+                logger.error("Processing update failed: %s", e)
+            finally:
+                queue.task_done()
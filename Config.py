@@ -0,0 +1,99 @@
+import json
+import os
+import re
+import threading
+
+import constants as c
+
+_configs = {}
+_config_lock = threading.Lock()
+
+
+class ConfigError(ValueError):
+    """The configuration file is missing or invalid"""
+
+
+def get_config(config_file=c.CONFIG_FILE):
+    """Return the parsed configuration file. The file is only parsed
+    again when its modification time changed since the last call
+
+    :param config_file: path to the configuration file
+    :type config_file: str
+    :return: configuration
+    :rtype: Config
+    """
+    try:
+        mtime = os.stat(config_file).st_mtime_ns
+    except OSError:
+        raise ConfigError("Config file {} not found".format(config_file))
+    config = _configs.get(config_file)
+    if config is not None and config.mtime == mtime:
+        return config
+    with _config_lock:
+        config = _configs.get(config_file)
+        if config is None or config.mtime != mtime:
+            with open(config_file) as f:
+                try:
+                    conf = json.load(f)
+                except ValueError as e:
+                    raise ConfigError("Config file {} is no valid json: {}".format(config_file, e))
+            config = Config(conf, mtime)
+            _configs[config_file] = config
+    return config
+
+
+class Config:
+    def __init__(self, conf: dict, mtime=0):
+        """
+        Validated settings of the configuration file.
+        :param conf: Parsed configuration file
+        :param mtime: Modification time of the parsed file
+        """
+        self.conf = conf
+        self.mtime = mtime
+        self.trainings = []
+        for training in conf.get("trainings", []):
+            if not isinstance(training.get("weekday"), int) or not 0 <= training["weekday"] <= 6:
+                raise ConfigError("Training weekday must be an int between 0 and 6: {}".format(training))
+            if not isinstance(training.get("time"), str) or not re.match(r"^\d{1,2}:\d{2}$", training["time"]):
+                raise ConfigError("Training time must have the format HH:MM: {}".format(training))
+            self.trainings.append({"weekday": training["weekday"], "time": training["time"]})
+        if "num_trainings" in conf and not isinstance(conf["num_trainings"], int):
+            raise ConfigError("num_trainings must be an int")
+
+    def get(self, key: str, default=None):
+        """
+        Get an optional setting.
+        :param key: Key in the configuration file
+        :param default: Value if the key is not set
+        """
+        return self.conf.get(key, default)
+
+    def require(self, key: str):
+        """
+        Get a mandatory setting.
+        :param key: Key in the configuration file
+        :raises ConfigError: if the key is not set
+        """
+        if key not in self.conf:
+            raise ConfigError("Key \"{}\" missing in config file".format(key))
+        return self.conf[key]
+
+    def get_bot_token(self) -> str:
+        return self.require(c.BOT_TOKEN)
+
+    def get_channel_id(self):
+        return self.get(c.CHANNEL_KEY)
+
+    def get_connect_string(self) -> str:
+        return self.require("database-connect-string")
+
+    def get_trainings(self) -> list:
+        """
+        Get the weekly training slots.
+        :return: List of dicts with weekday and time
+        """
+        return self.trainings
+
+    def get_num_trainings(self) -> int:
+        return self.require("num_trainings")
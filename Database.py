@@ -1,23 +1,199 @@
 import datetime
-import json
+import logging
 import os
+import threading
 
 import pymongo
-from bson.objectid import ObjectId
+from pymongo import monitoring
 
-from User import User
 import constants as c
-from Training import Training
-import util
+from Config import Config, get_config
+from Storage import Storage, get_cache
 
+logger = logging.getLogger(__name__)
+
+TRAINING_COLLECTIONS = ["trainings", "debug_trainings"]
+# name: (keys, options) of every index the trainings collections need
+TRAINING_INDEXES = {
+    "date_unique": ([("date", pymongo.ASCENDING)], {"unique": True}),
+    "coach_chat_id_date": ([("subtrainings.coach.chat_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], {}),
+    "attendee_chat_id_date": ([("subtrainings.attendees.chat_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)],
+                              {}),
+}
+# subtrainings of the split schema, see SplitDatabase
+SUBTRAINING_COLLECTIONS = ["subtrainings", "debug_subtrainings"]
+SUBTRAINING_INDEXES = {
+    "date_coach_chat_id_unique": ([("date", pymongo.ASCENDING), ("coach.chat_id", pymongo.ASCENDING)],
+                                  {"unique": True}),
+    "coach_chat_id_date": ([("coach.chat_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], {}),
+    "attendee_chat_id_date": ([("attendees.chat_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], {}),
+}
+# reverse index of the embedded schema: one document per chat_id, date and role
+USER_TRAINING_COLLECTIONS = ["user_trainings", "debug_user_trainings"]
+USER_TRAINING_INDEXES = {
+    "chat_id_role_date_unique": ([("chat_id", pymongo.ASCENDING), ("role", pymongo.ASCENDING),
+                                  ("date", pymongo.ASCENDING)], {"unique": True}),
+    "date_coach_chat_id": ([("date", pymongo.ASCENDING), ("coach_chat_id", pymongo.ASCENDING)], {}),
+}
+# trainings moved out of the trainings collection by Storage.archive_trainings
+ARCHIVE_COLLECTIONS = ["archived_trainings", "debug_archived_trainings"]
+ARCHIVE_INDEXES = {
+    "date_unique": ([("date", pymongo.ASCENDING)], {"unique": True}),
+}
+NOTIFICATION_COLLECTIONS = ["notifications", "debug_notifications"]
+NOTIFICATION_INDEXES = {
+    # a coach can also attend another subtraining at the same date
+    "chat_id_date_role_kind_unique": ([("chat_id", pymongo.ASCENDING), ("date", pymongo.ASCENDING),
+                                       ("role", pymongo.ASCENDING), ("kind", pymongo.ASCENDING)], {"unique": True}),
+    "sent_at_due_at": ([("sent_at", pymongo.ASCENDING), ("due_at", pymongo.ASCENDING)], {}),
+    "claim": ([("claim", pymongo.ASCENDING)], {}),
+}
+OUTBOX_COLLECTIONS = ["outbox", "debug_outbox"]
+OUTBOX_INDEXES = {
+    "next_attempt_at_created_at": ([("next_attempt_at", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)], {}),
+}
+# declared indexes of every collection
+COLLECTION_INDEXES = {}
+COLLECTION_INDEXES.update({name: TRAINING_INDEXES for name in TRAINING_COLLECTIONS})
+COLLECTION_INDEXES.update({name: SUBTRAINING_INDEXES for name in SUBTRAINING_COLLECTIONS})
+COLLECTION_INDEXES.update({name: USER_TRAINING_INDEXES for name in USER_TRAINING_COLLECTIONS})
+COLLECTION_INDEXES.update({name: ARCHIVE_INDEXES for name in ARCHIVE_COLLECTIONS})
+COLLECTION_INDEXES.update({name: NOTIFICATION_INDEXES for name in NOTIFICATION_COLLECTIONS})
+COLLECTION_INDEXES.update({name: OUTBOX_INDEXES for name in OUTBOX_COLLECTIONS})
+# indexes replaced by a declared index under another name, dropped by ensure_indexes
+REPLACED_INDEXES = {name: ["chat_id_date_kind_unique"] for name in NOTIFICATION_COLLECTIONS}
+# fields of a training document needed to display and notify the next trainings
+NEXT_TRAININGS_PROJECTION = {"date": 1, "time": 1, "link": 1, "subtrainings": 1}
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Keep track of the connections of the shared client pool"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.check_out_failures = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.check_out_failures += 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"open": self.open,
+                    "checked_out": self.checked_out,
+                    "peak_checked_out": self.peak_checked_out,
+                    "check_out_failures": self.check_out_failures}
+
+
+_client = None
+_client_options = {}
+_client_lock = threading.Lock()
+_pool_monitor = PoolMonitor()
+_indexed_collections = set()
+
+
+def get_date_query(after=None, before=None) -> dict:
+    """Query of the documents with after < date < before, None means no limit
+
+    :rtype: dict
+    """
+    date = {}
+    if after is not None:
+        date["$gt"] = after
+    if before is not None:
+        date["$lt"] = before
+    return {"date": date} if len(date) > 0 else {}
+
+
+def get_client(db_conf: Config) -> pymongo.MongoClient:
+    """Return the MongoClient shared by the whole process.
+    The client is created on the first call, every further call
+    reuses its connection pool
+
+    :param db_conf: configuration
+    :type db_conf: Config
+    :return: shared client
+    :rtype: pymongo.MongoClient
+    """
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            _client_options.update({
+                "maxPoolSize": db_conf.get("database-max-pool-size", c.DB_MAX_POOL_SIZE),
+                "minPoolSize": db_conf.get("database-min-pool-size", c.DB_MIN_POOL_SIZE),
+                "connectTimeoutMS": db_conf.get("database-connect-timeout-ms", c.DB_CONNECT_TIMEOUT_MS),
+                "serverSelectionTimeoutMS": db_conf.get("database-server-selection-timeout-ms",
+                                                        c.DB_SERVER_SELECTION_TIMEOUT_MS),
+                "socketTimeoutMS": db_conf.get("database-socket-timeout-ms", c.DB_SOCKET_TIMEOUT_MS),
+            })
+            _client = pymongo.MongoClient(db_conf.get_connect_string(),
+                                          event_listeners=[_pool_monitor],
+                                          **_client_options)
+    return _client
+
+
+def pool_stats() -> dict:
+    """Return the utilisation of the shared connection pool
+
+    :return: open and checked out connections, configured pool size
+    :rtype: dict
+    """
+    stats = _pool_monitor.get_stats()
+    stats["max_pool_size"] = _client_options.get("maxPoolSize")
+    stats["connected"] = _client is not None
+    return stats
+
+
+class Database(Storage):
+    """Storage of the trainings in a mongo db"""
 
-class Database:
     def __init__(self, config_file, debug_mode: bool):
-        self.config_file = config_file
+        super().__init__(config_file)
         self.connect_string = ""
         self.client = None
         self.database = None
         self.trainings = None
+        self.user_trainings = None
+        self.archive = None
+        self.notifications = None
+        self.outbox = None
         self.connect(debug_mode)
 
     def connect(self, debug_mode: bool):
@@ -25,265 +201,387 @@ class Database:
         if not os.path.isfile(self.config_file):
             return False
 
-        with open(self.config_file) as config_file:
-            db_conf = json.load(config_file)
+        db_conf = get_config(self.config_file)
         # use connect string
-        self.connect_string = db_conf["database-connect-string"]
-        # connect client
-        self.client = pymongo.MongoClient(self.connect_string)
+        self.connect_string = db_conf.get_connect_string()
+        # all Database objects share one client and its connection pool
+        self.client = get_client(db_conf)
         self.database = self.client.lockdown_training
         # collection for trainings
         if debug_mode:
             self.trainings = self.database["debug_trainings"]
+            self.user_trainings = self.database["debug_user_trainings"]
+            self.archive = self.database["debug_archived_trainings"]
+            self.notifications = self.database["debug_notifications"]
+            self.outbox = self.database["debug_outbox"]
         else:
             self.trainings = self.database["trainings"]
+            self.user_trainings = self.database["user_trainings"]
+            self.archive = self.database["archived_trainings"]
+            self.notifications = self.database["notifications"]
+            self.outbox = self.database["outbox"]
+        self.cache = get_cache("mongo:" + self.trainings.name)
+        self.ensure_indexes(once=True)
         return True
 
-    def add_training(self, training_date, time):
-        """add one training to the database with a unix timestamp
-        and a random meeting link
+    def ensure_indexes(self, once=False) -> dict:
+        """Create missing indexes and replace indexes whose definition
+        changed on all collections
 
-        :param training_date: day of the new training
-        :type training_date: datetime.date object
-        :param time: time of the training in 24h format
-        :type time: str
+        :param once: Only reconcile collections not yet handled by this process
+        :type once: bool
+        :return: names of created indexes per collection
+        :rtype: dict
         """
-        # make a correct date out of date and time
-        training_date = datetime.datetime(
-            training_date.year,
-            training_date.month,
-            training_date.day,
-            int(time.split(':')[0]),
-            int(time.split(':')[1])
-        )
-        # create a unix timestamp
-        unix_timestamp = int(training_date.strftime("%s"))
-        training = {
-            "date": unix_timestamp,
-            "time": time,
-            "attendees": [],
-            "subtrainings": [],
-            "link": c.MEETING_BASE_URL + util.get_random_string(num_of_chars=c.RANDOM_STR_LEN)
-        }
-        self.trainings.insert_one(training)
+        created = {}
+        for name, indexes in COLLECTION_INDEXES.items():
+            with _client_lock:
+                if once and name in _indexed_collections:
+                    continue
+                _indexed_collections.add(name)
+            created[name] = self._reconcile_indexes(self.database[name], indexes, REPLACED_INDEXES.get(name, []))
+        return created
 
-    def subtraining_add_attendee(self, attendee: User, date: int, coach: User):
-        """add an attendee to a subtraining"""
-        # find the correct training by date
-        training = self.trainings.find_one({"date": date})
-        # delete user from all subtrainings
-        for subtraining in training["subtrainings"]:
-            for usr in subtraining["attendees"]:
-                if attendee.chat_id == usr["chat_id"]:
-                    subtraining["attendees"].remove(usr)
-        # add the user to the wanted training
-        for subtraining in training["subtrainings"]:
-            if coach.get_chat_id() == subtraining["coach"]["chat_id"]:
-                subtraining["attendees"].append(attendee.get_dict())
-                break
-        # overwrite the old object
-        self.trainings.replace_one({"date": date}, training)
-        return "user removed from all other trainings and added to desired subtraining"
-
-    def training_add_attendee(self, attendee: User, date: int):
-        """add an attendee to a training"""
-        # check if user already is an attendee
-        training = self.trainings.find_one({"date": date})
-        for att in training["attendees"]:
-            if att["chat_id"] == attendee.get_chat_id():
-                return "user already is attendee"
-        # add the user to the training
-        self.trainings.update({"date": date}, {"$push": {"attendees": attendee.get_dict()}})
-        return "user was added"
-
-    def add_subtraining(self, training: Training):
-        """Add a subtraining to the database, only if the given
-        user has not signed in a training yet that day.
-        Also give the subtraining a random meeting link
-
-        :param training: Training object with user chosen data
-        :type training: Training
-        :return: Returns False if training already set by user
-        :rtype: bool
-        """
-        training_data = training.get_dict()
-        # add random link to database
-        training_data["link"] = c.MEETING_BASE_URL + util.get_random_string(num_of_chars=c.RANDOM_STR_LEN)
-
-        # check if user already has a training on that day
-        main_training = self.trainings.find_one({"date": training_data["date"]})
-        for subtraining in main_training["subtrainings"]:
-            if training_data["coach"]["chat_id"] == subtraining["coach"]["chat_id"]:
-                return False
-
-        # add the subtraining to the main training
-        self.trainings.update(
-            {"date": training_data["date"]},
-            {"$push": {"subtrainings": training_data}}
-        )
-        return True
+    @staticmethod
+    def _reconcile_indexes(collection, indexes: dict, replaced=()) -> list:
+        existing = collection.index_information()
+        created = []
+        for name in replaced:
+            if name in existing:
+                logger.info("Index %s on %s was replaced, dropping it", name, collection.name)
+                collection.drop_index(name)
+        for name, (keys, options) in indexes.items():
+            if name in existing:
+                if existing[name]["key"] == keys and \
+                        existing[name].get("unique", False) == options.get("unique", False):
+                    continue
+                logger.info("Index %s on %s changed, recreating it", name, collection.name)
+                collection.drop_index(name)
+            try:
+                collection.create_index(keys, name=name, **options)
+                created.append(name)
+            except pymongo.errors.OperationFailure as e:
+                # e.g. duplicate dates prevent the unique index
+                logger.error("Could not create index %s on %s: %s", name, collection.name, e)
+        return created
 
-    def get_my_trainings(self, user: User, role: int, offset=datetime.timedelta(seconds=0)) -> list:
-        """return all the subtrainings the user is
-        in as specified in the role
-
-        :param role: Specify the role of the user (can be COACH or ATTENDEE)
-        :type role: int
-        :param user: string with username
-        :type user: str
-        :param offset: Timedelta, how long a training can be in the past to be still shown
-        :type offset: datetime.timedelta
-        :return: returns the subtrainings as a list of dicts
-        :rtype: list
-        """
-        trainings = self.trainings.find({})
-        my_trainings = []
-        for training in trainings:
-            for subtraining in training["subtrainings"]:
-                tr = Training(from_dict=subtraining)
-                if (user.get_chat_id() == tr.get_coach().get_chat_id() and role == c.COACH)\
-                        or (user in tr.get_attendees() and role == c.ATTENDEE):
-                    if util.is_in_future(subtraining["date"], offset=offset):
-                        my_trainings.append(tr)
-        if len(my_trainings) > 0:
-            my_trainings.sort(key=lambda x: x.date, reverse=False)
-        return my_trainings
-
-    def get_subtrainings(self, user: User) -> list:
-        """get all subtrainings for a user
-
-        :param user: user object
-        :type user: obj
-        :return: list of dicts with all subtrainings
-        :rtype: list
-        """
-        trainings = self.trainings.find({})
-        user_subtrainings = []
-        for training in trainings:
-            for sub in training["subtrainings"]:
-                tr = Training(from_dict=sub)
-                for attendee in tr.get_attendees():
-                    if user.get_chat_id() == attendee.get_chat_id():
-                        user_subtrainings.append(tr)
-        return user_subtrainings
-
-    def cancel_subtrainings(self, date: int, user: User):
-        """remove user from the subtraining
-
-        :param date: date as unix-timestamp
-        :type date: int
-        :param user: user object
-        :type user: user
-        :return: return success message
-        :rtype: str
-        """
-        training = self.trainings.find_one({"date": date})
-        for subtraining in training["subtrainings"]:
-            for attendee in subtraining["attendees"]:
-                if attendee["chat_id"] == user.get_chat_id():
-                    subtraining["attendees"].remove(attendee)
-        # replace the old database entry
-        self.trainings.replace_one({"date": date}, training)
-        return "user was removed"
-
-    def remove_training_of_coach(self, coach: User, date: int) -> Training:
-        """remove training by coach username and date. Return data of 
-        the deleted training
-
-        :param coach: object of type Coach
-        :type coach: object
-        :param date: date as int unix timestamp
-        :type date: int
-        :return: dict with data of the deleted training 
+    def index_report(self) -> dict:
+        """Report declared indexes that are missing and indexes
+        that were never used since the server started
+
+        :return: missing, unused and undeclared index names per collection
         :rtype: dict
         """
-        training = self.trainings.find_one({"date": date})
-        for subtraining in training["subtrainings"]:
-            if coach.get_chat_id() == subtraining["coach"]["chat_id"]:
-                removed_subtraining = subtraining
-                # remove subtraining
-                training["subtrainings"].remove(subtraining)
-                # write to database
-                self.trainings.replace_one({"date": date}, training)
-                return Training(from_dict=removed_subtraining)
-
-    def create_trainings(self, number_of_days: int):
-        """Read training weekdays and time from the config file and 
-        Create all trainings accordingly for the time period of the 
-        next n days
-
-        :param number_of_days: How many days ahead trainings get created
-        :type number_of_days: int
-        """
-        # get the weekdays from the config file
-        with open('config.json') as config_file:
-            db_conf = json.load(config_file)
-        training_settings = db_conf["trainings"]
-        # loop through training weekdays
-        for training in training_settings:
-            today = datetime.date.today()
-            # loop through all days in the future
-            for i in range(number_of_days):
-                day = today + datetime.timedelta(i)
-                if day.weekday() == training["weekday"]:
-                    res = self.trainings.find_one({"date": str(day)})
-                    if res is None:
-                        self.add_training(training_date=day, time=training["time"])
-
-    def next_trainings(self, number_of_trainings=0, all=False):
-        """return the next n trainings from the database as a
-        list of dicts
-
-        :param number_of_trainings: How many trainings will be returned
-        :type number_of_trainings: int
-        :return: the trainings as a List of dicts
-        :rtype: list of dicts
+        report = {}
+        for name, indexes in COLLECTION_INDEXES.items():
+            collection = self.database[name]
+            existing = collection.index_information()
+            try:
+                usage = {s["name"]: s["accesses"]["ops"] for s in collection.aggregate([{"$indexStats": {}}])}
+            except pymongo.errors.OperationFailure as e:
+                logger.warning("No index statistics for %s: %s", name, e)
+                usage = {}
+            report[name] = {
+                "missing": [i for i in indexes if i not in existing],
+                "unused": [i for i, ops in usage.items() if ops == 0],
+                "undeclared": [i for i in existing if i not in indexes and i != "_id_"],
+            }
+        return report
+
+    @staticmethod
+    def _user_training_rows(subtraining: dict) -> list:
+        """Reverse index documents of the coach and the attendees of a subtraining"""
+        coach_chat_id = subtraining["coach"]["chat_id"]
+        users = [(coach_chat_id, c.COACH)] + [(a["chat_id"], c.ATTENDEE) for a in subtraining["attendees"]]
+        return [{"chat_id": chat_id, "date": subtraining["date"], "role": role, "coach_chat_id": coach_chat_id}
+                for chat_id, role in users]
+
+    def _upsert_user_trainings(self, rows: list):
+        if len(rows) == 0:
+            return
+        self.user_trainings.bulk_write([pymongo.UpdateOne(
+            {"chat_id": row["chat_id"], "date": row["date"], "role": row["role"]},
+            {"$set": {"coach_chat_id": row["coach_chat_id"]}},
+            upsert=True) for row in rows], ordered=False)
+
+    @staticmethod
+    def _user_training_match(row: dict) -> dict:
+        """Match of the unwound subtraining a reverse index row points at"""
+        match = {"subtrainings.date": row["date"], "subtrainings.coach.chat_id": row["coach_chat_id"]}
+        if row["role"] == c.ATTENDEE:
+            match["subtrainings.attendees.chat_id"] = row["chat_id"]
+        return match
+
+    def _delete_stale_user_trainings(self, rows: list) -> int:
+        """Delete the reverse index rows that no longer point at a subtraining of their user
+
+        :return: number of deleted rows
         """
-        trainings_list = self.trainings.find().sort("date")
-        trainings = []
+        if len(rows) == 0:
+            return 0
+        current = set()
+        for sub in self.trainings.aggregate([
+            {"$match": {"date": {"$in": list(set(row["date"] for row in rows))}}},
+            {"$unwind": "$subtrainings"},
+            {"$match": {"$or": [self._user_training_match(row) for row in rows]}},
+            {"$replaceRoot": {"newRoot": "$subtrainings"}},
+        ]):
+            current.update((row["chat_id"], row["date"], row["role"], row["coach_chat_id"])
+                           for row in self._user_training_rows(sub))
+        stale = [row for row in rows if (row["chat_id"], row["date"], row["role"], row["coach_chat_id"]) not in current]
+        if len(stale) == 0:
+            return 0
+        # with the coach in the filter a row the bot changed meanwhile is kept
+        return self.user_trainings.bulk_write([pymongo.DeleteOne({
+            "chat_id": row["chat_id"], "date": row["date"], "role": row["role"], "coach_chat_id": row["coach_chat_id"]
+        }) for row in stale], ordered=False).deleted_count
 
-        added_trainings = 0
-        for tr in trainings_list:
-            if added_trainings >= number_of_trainings and all is False:
-                break
-            if util.is_in_future(tr["date"]):
-                tr["date"] = datetime.datetime.fromtimestamp(tr["date"])
-                trainings.append(tr)
-                added_trainings += 1
-        return trainings
-
-    def delete_all_trainings(self):
-        """delete all training database entries
+    def rebuild_user_trainings(self) -> tuple:
+        """Upsert the reverse index rows of all subtrainings and then delete
+        the rows that no longer match a subtraining, needed once for
+        trainings created before the index existed. The bot can keep running,
+        rows written from an outdated read are removed by the second pass
+
+        :return: number of upserted and of deleted rows
+        :rtype: tuple
         """
-        self.trainings.drop()
+        upserted = 0
+        rows = []
+        for sub in self.trainings.aggregate([{"$unwind": "$subtrainings"},
+                                             {"$replaceRoot": {"newRoot": "$subtrainings"}}]):
+            rows.extend(self._user_training_rows(sub))
+            if len(rows) >= c.MIGRATION_BATCH_SIZE:
+                self._upsert_user_trainings(rows)
+                upserted += len(rows)
+                rows = []
+        self._upsert_user_trainings(rows)
+        upserted += len(rows)
+
+        deleted = 0
+        rows = []
+        for row in self.user_trainings.find({}, {"_id": 0}).batch_size(c.MIGRATION_BATCH_SIZE):
+            rows.append(row)
+            if len(rows) >= c.MIGRATION_BATCH_SIZE:
+                deleted += self._delete_stale_user_trainings(rows)
+                rows = []
+        deleted += self._delete_stale_user_trainings(rows)
+        return upserted, deleted
 
-    def delete_future_trainings(self):
-        """delete all trainings in the future
+    def _insert_training(self, training: dict):
+        self.trainings.insert_one(training)
+        self._upsert_user_trainings([row for sub in training.get("subtrainings", [])
+                                     for row in self._user_training_rows(sub)])
+
+    def _upsert_new_trainings(self, trainings: list) -> list:
+        """Insert the training documents whose date does not exist yet
+        and index their subtrainings
+
+        :return: the inserted trainings
         """
-        trainings = self.next_trainings(all=True)
-        for training in trainings:
-            self.trainings.delete_one({'_id': ObjectId(training["_id"])})
-        
-    def set_notify_now_flag(self, flag: bool, subtraining: Training, user: User):
-        training = self.trainings.find_one({"date": int(subtraining.get_date())})
-        for sub in training["subtrainings"]:
-            if user.is_coach():
-                if user.get_chat_id() == sub["coach"]["chat_id"]:
-                    sub["coach"]["notified_now"] = flag
-            if user.is_attendee():
-                for att in sub["attendees"]:
-                    if user.get_chat_id() == att["chat_id"]:
-                        att["notified_now"] = flag
-        self.trainings.replace_one({"date": int(subtraining.get_date())}, training)
-
-    def set_notify_far_flag(self, flag: bool, subtraining: Training, user: User):
-        training = self.trainings.find_one({"date": int(subtraining.get_date())})
-        for sub in training["subtrainings"]:
-            if user.is_coach():
-                if user.get_chat_id() == sub["coach"]["chat_id"]:
-                    sub["coach"]["notified_far"] = flag
-            if user.is_attendee():
-                for att in sub["attendees"]:
-                    if user.get_chat_id() == att["chat_id"]:
-                        att["notified_far"] = flag
-        self.trainings.replace_one({"date": int(subtraining.get_date())}, training)
\ No newline at end of file
+        # one round trip, the unique date index turns existing dates into no-ops
+        result = self.trainings.bulk_write([pymongo.UpdateOne({"date": training["date"]},
+                                                              {"$setOnInsert": training}, upsert=True)
+                                            for training in trainings], ordered=False)
+        created = [trainings[i] for i in sorted(result.upserted_ids)]
+        self._upsert_user_trainings([row for training in created for sub in training.get("subtrainings", [])
+                                     for row in self._user_training_rows(sub)])
+        return created
+
+    def _insert_missing_trainings(self, trainings: list) -> int:
+        return len(self._upsert_new_trainings(trainings))
+
+    def _last_training_date(self):
+        training = self.trainings.find_one({}, {"_id": 0, "date": 1}, sort=[("date", pymongo.DESCENDING)])
+        return None if training is None else training["date"]
+
+    def _move_attendee(self, date: int, attendee: dict, coach_chat_id):
+        # in one update: delete user from all subtrainings and add the user to the wanted one
+        in_other = {"$filter": {"input": "$$sub.attendees", "as": "att",
+                                "cond": {"$ne": ["$$att.chat_id", attendee["chat_id"]]}}}
+        added = {"$cond": [{"$eq": ["$$sub.coach.chat_id", coach_chat_id]},
+                           [{"$literal": attendee}],
+                           []]}
+        self.trainings.update_one({"date": date}, [
+            {"$set": {"subtrainings": {"$map": {
+                "input": "$subtrainings", "as": "sub",
+                "in": {"$mergeObjects": ["$$sub", {"attendees": {"$concatArrays": [in_other, added]}}]}}}}}
+        ])
+        key = {"chat_id": attendee["chat_id"], "date": date, "role": c.ATTENDEE}
+        if self.trainings.count_documents({"date": date, "subtrainings.coach.chat_id": coach_chat_id}, limit=1) > 0:
+            self.user_trainings.update_one(key, {"$set": {"coach_chat_id": coach_chat_id}}, upsert=True)
+        else:
+            self.user_trainings.delete_one(key)
+
+    def _add_training_attendee(self, date: int, attendee: dict) -> bool:
+        # only add the user if not already an attendee
+        result = self.trainings.update_one(
+            {"date": date, "attendees.chat_id": {"$ne": attendee["chat_id"]}},
+            {"$push": {"attendees": attendee}}
+        )
+        return result.matched_count == 1
+
+    def _insert_subtraining(self, subtraining: dict) -> bool:
+        # add the subtraining to the main training, only if the user
+        # has no training on that day yet
+        result = self.trainings.update_one(
+            {"date": subtraining["date"], "subtrainings.coach.chat_id": {"$ne": subtraining["coach"]["chat_id"]}},
+            {"$push": {"subtrainings": subtraining}}
+        )
+        if result.modified_count != 1:
+            return False
+        self._upsert_user_trainings(self._user_training_rows(subtraining))
+        return True
+
+    def _find_subtrainings(self, chat_id, role: int, cutoff=None) -> list:
+        """Look up the dates of the user in the reverse index and
+        only fetch these subtrainings, sorted by date"""
+        query = {"chat_id": chat_id, "role": role}
+        if cutoff is not None:
+            query["date"] = {"$gt": cutoff}
+        rows = list(self.user_trainings.find(query, {"_id": 0}))
+        if len(rows) == 0:
+            return []
+        pipeline = [
+            {"$match": {"date": {"$in": [row["date"] for row in rows]}}},
+            {"$unwind": "$subtrainings"},
+            # an attendee row only matches while the user still is an attendee
+            {"$match": {"$or": [self._user_training_match(row) for row in rows]}},
+            {"$replaceRoot": {"newRoot": "$subtrainings"}},
+            {"$sort": {"date": 1}},
+        ]
+        return list(self.trainings.aggregate(pipeline))
+
+    def _remove_attendee(self, date: int, chat_id):
+        self.trainings.update_one(
+            {"date": date},
+            {"$pull": {"subtrainings.$[].attendees": {"chat_id": chat_id}}}
+        )
+        self.user_trainings.delete_one({"chat_id": chat_id, "date": date, "role": c.ATTENDEE})
+
+    def _remove_subtraining(self, date: int, coach_chat_id):
+        # remove the subtraining and get it back in the same round trip
+        training = self.trainings.find_one_and_update(
+            {"date": date, "subtrainings.coach.chat_id": coach_chat_id},
+            {"$pull": {"subtrainings": {"coach.chat_id": coach_chat_id}}},
+            projection={"_id": 0, "subtrainings": {"$elemMatch": {"coach.chat_id": coach_chat_id}}},
+            return_document=pymongo.ReturnDocument.BEFORE
+        )
+        if training is None:
+            return None
+        # the rows of the coach and of all attendees of the subtraining
+        self.user_trainings.delete_many({"date": date, "coach_chat_id": coach_chat_id})
+        return training["subtrainings"][0]
+
+    def iter_next_trainings(self, limit=0, projection=None):
+        now = datetime.datetime.now().timestamp()
+        if projection is None:
+            projection = NEXT_TRAININGS_PROJECTION
+        cursor = self.trainings.find({"date": {"$gt": now}}, projection).sort("date", pymongo.ASCENDING).limit(limit)
+        for tr in cursor:
+            tr["date"] = datetime.datetime.fromtimestamp(tr["date"])
+            yield tr
+
+    def _iter_trainings(self, batch_size: int):
+        yield from self.trainings.find({}, {"_id": 0}).sort("date", pymongo.ASCENDING).batch_size(batch_size)
+
+    def _delete_trainings(self, after=None, before=None):
+        # one range delete each, the collections keep their indexes
+        query = get_date_query(after, before)
+        self.trainings.delete_many(query)
+        self.user_trainings.delete_many(query)
+
+    def _archive_batch(self, before: float, limit: int) -> list:
+        """Oldest training documents before a unix timestamp with their subtrainings"""
+        return list(self.trainings.find({"date": {"$lt": before}}, {"_id": 0})
+                    .sort("date", pymongo.ASCENDING).limit(limit))
+
+    def _delete_until(self, date: int):
+        """Delete the trainings up to and including a unix timestamp"""
+        self.trainings.delete_many({"date": {"$lte": date}})
+        self.user_trainings.delete_many({"date": {"$lte": date}})
+
+    def _archive_trainings(self, before: float, limit: int) -> int:
+        trainings = self._archive_batch(before, limit)
+        if len(trainings) == 0:
+            return 0
+        # upserts, a batch interrupted before the delete is archived again without duplicates
+        self.archive.bulk_write([pymongo.ReplaceOne({"date": tr["date"]}, tr, upsert=True) for tr in trainings],
+                                ordered=False)
+        self._delete_until(trainings[-1]["date"])
+        return len(trainings)
+
+    def _iter_archive(self, start=None, end=None, batch_size=c.EXPORT_BATCH_SIZE):
+        query = {}
+        if start is not None:
+            query["$gte"] = start
+        if end is not None:
+            query["$lt"] = end
+        yield from self.archive.find({"date": query} if len(query) > 0 else {}, {"_id": 0}) \
+            .sort("date", pymongo.ASCENDING).batch_size(batch_size)
+
+    def _ledger_upsert(self, rows: list):
+        if len(rows) == 0:
+            return
+        self.notifications.bulk_write([pymongo.UpdateOne(
+            {"chat_id": row["chat_id"], "date": row["date"], "role": row["role"], "kind": row["kind"]},
+            {"$set": {"due_at": row["due_at"], "coach_chat_id": row["coach_chat_id"]},
+             "$setOnInsert": {"sent_at": None}},
+            upsert=True) for row in rows], ordered=False)
+
+    def _ledger_delete(self, date=None, chat_ids=None, role=None, after=None, before=None):
+        if date is not None:
+            self.notifications.delete_many({"date": date, "role": role, "chat_id": {"$in": chat_ids}})
+        else:
+            self.notifications.delete_many(get_date_query(after, before))
+
+    def _ledger_due(self, now: float) -> list:
+        return list(self.notifications.find({"sent_at": None, "due_at": {"$lte": now}, "date": {"$gt": now}},
+                                            {"_id": 0}).sort("due_at", pymongo.ASCENDING))
+
+    def _ledger_claim_due(self, now: float, claim: str) -> list:
+        self.notifications.update_many({"sent_at": None, "due_at": {"$lte": now}, "date": {"$gt": now}},
+                                       {"$set": {"sent_at": now, "claim": claim}})
+        return list(self.notifications.find({"claim": claim}, {"_id": 0, "claim": 0})
+                    .sort("due_at", pymongo.ASCENDING))
+
+    def _ledger_release(self, rows: list):
+        self.notifications.bulk_write([pymongo.UpdateOne(
+            {"chat_id": row["chat_id"], "date": row["date"], "role": row["role"], "kind": row["kind"]},
+            {"$set": {"sent_at": None, "claim": None}}) for row in rows], ordered=False)
+
+    def _ledger_set_sent(self, row: dict, sent_at) -> bool:
+        query = {"chat_id": row["chat_id"], "date": row["date"], "role": row["role"], "kind": row["kind"]}
+        if sent_at is not None:
+            query["sent_at"] = None
+        return self.notifications.update_one(query, {"$set": {"sent_at": sent_at}}).modified_count == 1
+
+    def _ledger_next_due(self, now: float):
+        row = self.notifications.find_one({"sent_at": None, "due_at": {"$gt": now}}, {"due_at": 1},
+                                          sort=[("due_at", pymongo.ASCENDING)])
+        return row["due_at"] if row is not None else None
+
+    def _outbox_insert(self, rows: list):
+        if len(rows) > 0:
+            self.outbox.insert_many([dict(row) for row in rows], ordered=False)
+
+    def _outbox_claim(self, now: float, lease_until: float, limit: int) -> list:
+        # claim one message after the other, so two senders never get the same message
+        rows = []
+        while len(rows) < limit:
+            row = self.outbox.find_one_and_update(
+                {"next_attempt_at": {"$lte": now}},
+                {"$set": {"next_attempt_at": lease_until}},
+                sort=[("next_attempt_at", pymongo.ASCENDING), ("created_at", pymongo.ASCENDING)],
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if row is None:
+                break
+            row["id"] = row.pop("_id")
+            rows.append(row)
+        return rows
+
+    def _outbox_delete(self, row_id):
+        self.outbox.delete_one({"_id": row_id})
+
+    def _outbox_retry(self, row_id, attempts: int, next_attempt_at: float):
+        self.outbox.update_one({"_id": row_id}, {"$set": {"attempts": attempts, "next_attempt_at": next_attempt_at}})
@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+import constants as c
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Global and per chat token buckets. One limiter is shared by all
+    fan-outs of a bot, so the limits hold across batches and senders"""
+
+    def __init__(self, global_rate=c.TELEGRAM_GLOBAL_RATE, chat_rate=c.TELEGRAM_CHAT_RATE):
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets = {}
+        self.lock = threading.Lock()
+
+    def get_chat_bucket(self, chat_id) -> TokenBucket:
+        with self.lock:
+            if chat_id not in self.chat_buckets:
+                self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+            return self.chat_buckets[chat_id]
+
+    def acquire(self, chat_id):
+        """Block until a message to chat_id may be sent"""
+        self.get_chat_bucket(chat_id).acquire()
+        self.global_bucket.acquire()
+
+    def prune(self, idle=60):
+        """Drop the chat buckets unused for idle seconds, they are full
+        again and behave like new ones
+
+        :param idle: seconds since the last message to the chat
+        :type idle: float
+        """
+        now = time.monotonic()
+        with self.lock:
+            for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items() if now - bucket.last >= idle]:
+                del self.chat_buckets[chat_id]
+
+
+class FanoutReport:
+    """Outcome and timing of one fan-out run"""
+
+    def __init__(self, delivered: list, latencies: list, duration: float, retries: int):
+        self.delivered = delivered
+        self.latencies = sorted(latencies)
+        self.duration = duration
+        self.retries = retries
+
+    def get_sent(self) -> int:
+        return sum(1 for d in self.delivered if d)
+
+    def get_failed(self) -> int:
+        return len(self.delivered) - self.get_sent()
+
+    def get_throughput(self) -> float:
+        """Delivered messages per second"""
+        return self.get_sent() / self.duration if self.duration > 0 else 0.0
+
+    def get_latency(self, percentile: float) -> float:
+        """Seconds from the start of the run until a message was delivered"""
+        if len(self.latencies) == 0:
+            return 0.0
+        idx = min(len(self.latencies) - 1, int(percentile / 100 * len(self.latencies)))
+        return self.latencies[idx]
+
+    def __str__(self):
+        return "sent {}, failed {}, retries {}, {:.1f} msg/s, latency p50 {:.2f}s p95 {:.2f}s max {:.2f}s".format(
+            self.get_sent(), self.get_failed(), self.retries, self.get_throughput(),
+            self.get_latency(50), self.get_latency(95), self.get_latency(100))
+
+
+class Fanout:
+    """Send many messages concurrently while respecting the global
+    and per chat rate limits of the telegram bot api"""
+
+    def __init__(self, send, workers=c.FANOUT_WORKERS, limiter=None, max_retries=c.FANOUT_MAX_RETRIES):
+        """
+        :param send: Function sending one message, called as send(message=..., chat_id=...)
+        :param workers: Number of concurrent senders
+        :param limiter: RateLimiter shared with the other senders of the bot, a new one if None
+        :param max_retries: How often a message is retried after a rate limit or network error
+        """
+        self.send = send
+        self.workers = workers
+        self.limiter = RateLimiter() if limiter is None else limiter
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.retries = 0
+
+    def deliver(self, chat_id, message: str) -> bool:
+        """Send one message, retrying when telegram asks to slow down
+
+        :return: True if the message was delivered
+        """
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(chat_id)
+            try:
+                self.send(message=message, chat_id=chat_id)
+                return True
+            except RetryAfter as e:
+                logger.warning("Rate limited while notifying %s, retry after %ss", chat_id, e.retry_after)
+                time.sleep(e.retry_after)
+            except BadRequest as e:
+                # also a NetworkError, but retrying does not help
+                logger.error("Could not notify %s: %s", chat_id, e)
+                return False
+            except NetworkError as e:
+                logger.warning("Network error while notifying %s: %s", chat_id, e)
+                time.sleep(2 ** attempt)
+            except TelegramError as e:
+                logger.error("Could not notify %s: %s", chat_id, e)
+                return False
+            with self.lock:
+                self.retries += 1
+        logger.error("Giving up to notify %s after %s retries", chat_id, self.max_retries)
+        return False
+
+    def run(self, messages: list) -> FanoutReport:
+        """Deliver all messages and wait until every one is done
+
+        :param messages: list of (chat_id, message) tuples
+        :type messages: list
+        :return: report with one delivery flag per message in input order
+        :rtype: FanoutReport
+        """
+        start = time.monotonic()
+        latencies = []
+        self.retries = 0
+
+        def task(chat_id, message):
+            delivered = self.deliver(chat_id, message)
+            if delivered:
+                with self.lock:
+                    latencies.append(time.monotonic() - start)
+            return delivered
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(task, chat_id, message) for chat_id, message in messages]
+            delivered = [f.result() for f in futures]
+        report = FanoutReport(delivered, latencies, time.monotonic() - start, self.retries)
+        logger.info("Fan-out of %s messages: %s", len(messages), report)
+        return report
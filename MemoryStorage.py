@@ -0,0 +1,273 @@
+import copy
+import datetime
+import itertools
+import threading
+
+import constants as c
+from Storage import Storage, get_cache
+
+# trainings and archived trainings of every collection by date, reverse indexes
+# chat_id -> {(date, role): coach_chat_id}, notification ledgers by (chat_id, date, role, kind)
+# and outboxes by id, shared by all MemoryStorage objects
+_collections = {}
+_archives = {}
+_user_trainings = {}
+_ledgers = {}
+_outboxes = {}
+_locks = {}
+_collections_lock = threading.Lock()
+_outbox_ids = itertools.count(1)
+
+
+def _in_range(date, after=None, before=None) -> bool:
+    return (after is None or date > after) and (before is None or date < before)
+
+
+class MemoryStorage(Storage):
+    """Storage of the trainings in the memory of the process.
+    Nothing is persisted, useful for small deployments and benchmarks"""
+
+    def __init__(self, config_file=c.CONFIG_FILE, debug_mode=False, name=None):
+        """
+        :param config_file: Path to the config file
+        :param debug_mode: Use the debug trainings
+        :param name: Name of the collection, defaults to trainings or debug_trainings
+        """
+        super().__init__(config_file)
+        if name is None:
+            name = "debug_trainings" if debug_mode else "trainings"
+        self.name = name
+        with _collections_lock:
+            self.trainings = _collections.setdefault(name, {})
+            self.archive = _archives.setdefault(name, {})
+            self.user_trainings = _user_trainings.setdefault(name, {})
+            self.ledger = _ledgers.setdefault(name, {})
+            self.outbox = _outboxes.setdefault(name, {})
+            self.lock = _locks.setdefault(name, threading.RLock())
+        self.cache = get_cache("memory:" + name)
+
+    def _index_subtraining(self, subtraining: dict):
+        coach_chat_id = subtraining["coach"]["chat_id"]
+        self.user_trainings.setdefault(coach_chat_id, {})[(subtraining["date"], c.COACH)] = coach_chat_id
+        for attendee in subtraining["attendees"]:
+            self.user_trainings.setdefault(attendee["chat_id"], {})[(subtraining["date"], c.ATTENDEE)] = coach_chat_id
+
+    def _insert_training(self, training: dict):
+        with self.lock:
+            if training["date"] in self.trainings:
+                raise ValueError("Training at {} already exists".format(training["date"]))
+            self.trainings[training["date"]] = copy.deepcopy(training)
+            for sub in training["subtrainings"]:
+                self._index_subtraining(sub)
+
+    def _insert_missing_trainings(self, trainings: list) -> int:
+        created = 0
+        with self.lock:
+            for training in trainings:
+                if training["date"] not in self.trainings:
+                    self.trainings[training["date"]] = copy.deepcopy(training)
+                    for sub in training.get("subtrainings", []):
+                        self._index_subtraining(sub)
+                    created += 1
+        return created
+
+    def _last_training_date(self):
+        with self.lock:
+            return max(self.trainings, default=None)
+
+    def _move_attendee(self, date: int, attendee: dict, coach_chat_id):
+        with self.lock:
+            training = self.trainings.get(date)
+            if training is None:
+                return
+            self.user_trainings.get(attendee["chat_id"], {}).pop((date, c.ATTENDEE), None)
+            for sub in training["subtrainings"]:
+                sub["attendees"] = [a for a in sub["attendees"] if a["chat_id"] != attendee["chat_id"]]
+                if sub["coach"]["chat_id"] == coach_chat_id:
+                    sub["attendees"].append(dict(attendee))
+                    self.user_trainings.setdefault(attendee["chat_id"], {})[(date, c.ATTENDEE)] = coach_chat_id
+
+    def _add_training_attendee(self, date: int, attendee: dict) -> bool:
+        with self.lock:
+            training = self.trainings.get(date)
+            if training is None or attendee["chat_id"] in [a["chat_id"] for a in training["attendees"]]:
+                return False
+            training["attendees"].append(dict(attendee))
+            return True
+
+    def _insert_subtraining(self, subtraining: dict) -> bool:
+        with self.lock:
+            training = self.trainings.get(subtraining["date"])
+            if training is None:
+                return False
+            for sub in training["subtrainings"]:
+                if sub["coach"]["chat_id"] == subtraining["coach"]["chat_id"]:
+                    return False
+            training["subtrainings"].append(copy.deepcopy(subtraining))
+            self._index_subtraining(subtraining)
+            return True
+
+    def _find_subtrainings(self, chat_id, role: int, cutoff=None) -> list:
+        subtrainings = []
+        with self.lock:
+            for (date, row_role), coach_chat_id in self.user_trainings.get(chat_id, {}).items():
+                if row_role != role or (cutoff is not None and date <= cutoff):
+                    continue
+                for sub in self.trainings[date]["subtrainings"]:
+                    if sub["coach"]["chat_id"] == coach_chat_id:
+                        subtrainings.append(copy.deepcopy(sub))
+        subtrainings.sort(key=lambda sub: sub["date"])
+        return subtrainings
+
+    def _remove_attendee(self, date: int, chat_id):
+        with self.lock:
+            training = self.trainings.get(date)
+            if training is None:
+                return
+            self.user_trainings.get(chat_id, {}).pop((date, c.ATTENDEE), None)
+            for sub in training["subtrainings"]:
+                sub["attendees"] = [a for a in sub["attendees"] if a["chat_id"] != chat_id]
+
+    def _remove_subtraining(self, date: int, coach_chat_id):
+        with self.lock:
+            training = self.trainings.get(date)
+            if training is None:
+                return None
+            for sub in training["subtrainings"]:
+                if sub["coach"]["chat_id"] == coach_chat_id:
+                    training["subtrainings"].remove(sub)
+                    self.user_trainings.get(coach_chat_id, {}).pop((date, c.COACH), None)
+                    for attendee in sub["attendees"]:
+                        self.user_trainings.get(attendee["chat_id"], {}).pop((date, c.ATTENDEE), None)
+                    return sub
+        return None
+
+    def iter_next_trainings(self, limit=0, projection=None):
+        now = datetime.datetime.now().timestamp()
+        with self.lock:
+            dates = sorted(date for date in self.trainings if date > now)
+        if limit > 0:
+            dates = dates[:limit]
+        for date in dates:
+            with self.lock:
+                training = copy.deepcopy(self.trainings.get(date))
+            if training is None:
+                continue
+            training["date"] = datetime.datetime.fromtimestamp(training["date"])
+            yield training
+
+    def _iter_trainings(self, batch_size: int):
+        with self.lock:
+            dates = sorted(self.trainings)
+        for date in dates:
+            with self.lock:
+                training = copy.deepcopy(self.trainings.get(date))
+            if training is not None:
+                yield training
+
+    def _delete_trainings(self, after=None, before=None):
+        with self.lock:
+            for date in [date for date in self.trainings if _in_range(date, after, before)]:
+                del self.trainings[date]
+            for rows in self.user_trainings.values():
+                for key in [key for key in rows if _in_range(key[0], after, before)]:
+                    del rows[key]
+
+    def _archive_trainings(self, before: float, limit: int) -> int:
+        with self.lock:
+            dates = sorted(date for date in self.trainings if date < before)[:limit]
+            for date in dates:
+                self.archive[date] = self.trainings.pop(date)
+            archived = set(dates)
+            for rows in self.user_trainings.values():
+                for key in [key for key in rows if key[0] in archived]:
+                    del rows[key]
+        return len(dates)
+
+    def _iter_archive(self, start=None, end=None, batch_size=c.EXPORT_BATCH_SIZE):
+        with self.lock:
+            dates = sorted(date for date in self.archive
+                           if (start is None or date >= start) and (end is None or date < end))
+        for date in dates:
+            with self.lock:
+                training = copy.deepcopy(self.archive.get(date))
+            if training is not None:
+                yield training
+
+    def _ledger_upsert(self, rows: list):
+        with self.lock:
+            for row in rows:
+                key = (row["chat_id"], row["date"], row["role"], row["kind"])
+                if key in self.ledger:
+                    self.ledger[key].update(row)
+                else:
+                    self.ledger[key] = dict(row, sent_at=None)
+
+    def _ledger_delete(self, date=None, chat_ids=None, role=None, after=None, before=None):
+        with self.lock:
+            for key, row in list(self.ledger.items()):
+                if date is not None and (row["date"] != date or row["role"] != role or row["chat_id"] not in chat_ids):
+                    continue
+                if not _in_range(row["date"], after, before):
+                    continue
+                del self.ledger[key]
+
+    def _ledger_due(self, now: float) -> list:
+        with self.lock:
+            rows = [dict(row) for row in self.ledger.values()
+                    if row["sent_at"] is None and row["due_at"] <= now < row["date"]]
+        rows.sort(key=lambda row: row["due_at"])
+        return rows
+
+    def _ledger_claim_due(self, now: float, claim: str) -> list:
+        with self.lock:
+            rows = [row for row in self.ledger.values()
+                    if row["sent_at"] is None and row["due_at"] <= now < row["date"]]
+            for row in rows:
+                row["sent_at"] = now
+            rows = [dict(row) for row in rows]
+        rows.sort(key=lambda row: row["due_at"])
+        return rows
+
+    def _ledger_release(self, rows: list):
+        with self.lock:
+            for row in rows:
+                stored = self.ledger.get((row["chat_id"], row["date"], row["role"], row["kind"]))
+                if stored is not None:
+                    stored["sent_at"] = None
+
+    def _ledger_set_sent(self, row: dict, sent_at) -> bool:
+        with self.lock:
+            stored = self.ledger.get((row["chat_id"], row["date"], row["role"], row["kind"]))
+            if stored is None or (sent_at is not None and stored["sent_at"] is not None):
+                return False
+            stored["sent_at"] = sent_at
+            return True
+
+    def _ledger_next_due(self, now: float):
+        with self.lock:
+            due = [row["due_at"] for row in self.ledger.values() if row["sent_at"] is None and row["due_at"] > now]
+        return min(due) if len(due) > 0 else None
+
+    def _outbox_insert(self, rows: list):
+        with self.lock:
+            for row in rows:
+                row_id = next(_outbox_ids)
+                self.outbox[row_id] = dict(row, id=row_id)
+
+    def _outbox_claim(self, now: float, lease_until: float, limit: int) -> list:
+        with self.lock:
+            rows = sorted((row for row in self.outbox.values() if row["next_attempt_at"] <= now),
+                          key=lambda row: row["created_at"])[:limit]
+            for row in rows:
+                row["next_attempt_at"] = lease_until
+            return [dict(row) for row in rows]
+
+    def _outbox_delete(self, row_id):
+        with self.lock:
+            self.outbox.pop(row_id, None)
+
+    def _outbox_retry(self, row_id, attempts: int, next_attempt_at: float):
+        with self.lock:
+            if row_id in self.outbox:
+                self.outbox[row_id].update(attempts=attempts, next_attempt_at=next_attempt_at)
@@ -1,18 +1,47 @@
+import threading
+
 from telegram import Bot, ParseMode
-import json
+from telegram.utils.request import Request
+
 import constants as c
+from Config import get_config
+from Fanout import Fanout, FanoutReport, RateLimiter
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """Return the Notifier shared by the whole process.
+    It is created on the first call and keeps its connections alive
+
+    :return: shared notifier
+    :rtype: Notifier
+    """
+    global _notifier
+    if _notifier is not None:
+        return _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = Notifier()
+    return _notifier
 
 
 class Notifier:
     def __init__(self):
         self.bot = None
+        self.pool_size = c.TELEGRAM_POOL_SIZE
+        # the rate limits of telegram apply to all batches of the bot together
+        self.limiter = RateLimiter()
         self.connect_bot()
-        
+
     def connect_bot(self):
         # read token from config
-        with open("config.json") as f:
-            conf = json.load(f)
-        self.bot = Bot(token=conf[c.BOT_TOKEN])
+        conf = get_config()
+        self.pool_size = conf.get("telegram-pool-size", c.TELEGRAM_POOL_SIZE)
+        # keep-alive connection pool shared by all sending threads
+        request = Request(con_pool_size=self.pool_size)
+        self.bot = Bot(token=conf.get_bot_token(), request=request)
 
     def notify(self, message: str, chat_id):
         self.bot.send_message(
@@ -20,3 +49,14 @@ class Notifier:
             text=message,
             parse_mode=ParseMode.MARKDOWN,
             disable_web_page_preview=True)
+
+    def notify_many(self, messages: list) -> FanoutReport:
+        """Send a batch of messages concurrently
+
+        :param messages: list of (chat_id, message) tuples
+        :type messages: list
+        :return: report with one delivery flag per message in input order
+        :rtype: FanoutReport
+        """
+        self.limiter.prune()
+        return Fanout(self.notify, workers=min(self.pool_size, c.FANOUT_WORKERS), limiter=self.limiter).run(messages)
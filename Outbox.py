@@ -0,0 +1,79 @@
+import logging
+import threading
+
+import constants as c
+from Notifier import Notifier
+from Storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxSender:
+    """Send the messages of the outbox in the background, so handlers
+    never wait for telegram. Failed messages are retried with
+    exponential backoff and dropped after OUTBOX_MAX_ATTEMPTS attempts"""
+
+    def __init__(self, job_queue, db: Storage, notifier: Notifier):
+        """
+        :param job_queue: JobQueue of the bot
+        :param db: Storage object holding the outbox
+        :param notifier: Notifier object
+        """
+        self.job_queue = job_queue
+        self.db = db
+        self.notifier = notifier
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = False
+
+    def start(self):
+        """Drain the outbox now and then every OUTBOX_POLL_SECONDS,
+        which also picks up retries and messages of crashed senders"""
+        self.job_queue.run_repeating(self.run, interval=c.OUTBOX_POLL_SECONDS, first=0, name="outbox")
+
+    def poke(self):
+        """Drain the outbox as soon as possible after messages were enqueued"""
+        with self.lock:
+            if self.running:
+                # the running drain picks up the new messages
+                self.pending = True
+                return
+        self.job_queue.run_once(self.run, when=0, name="outbox")
+
+    def run(self, context=None):
+        """Job callback: send batches of due messages until the outbox has none left"""
+        with self.lock:
+            if self.running:
+                self.pending = True
+                return
+            self.running = True
+        try:
+            while True:
+                with self.lock:
+                    self.pending = False
+                if self.drain() == 0:
+                    with self.lock:
+                        if not self.pending:
+                            return
+        except Exception as e:
+            logger.error("Outbox run failed: %s", e)
+        finally:
+            with self.lock:
+                self.running = False
+
+    def drain(self) -> int:
+        """Send one batch of due messages
+
+        :return: number of claimed messages
+        :rtype: int
+        """
+        rows = self.db.claim_messages()
+        if len(rows) == 0:
+            return 0
+        report = self.notifier.notify_many([(row["chat_id"], row["message"]) for row in rows])
+        for row, delivered in zip(rows, report.delivered):
+            if delivered:
+                self.db.complete_message(row)
+            elif not self.db.retry_message(row):
+                logger.error("Dropped message to %s after %s attempts", row["chat_id"], c.OUTBOX_MAX_ATTEMPTS)
+        return len(rows)
@@ -0,0 +1,185 @@
+import datetime
+import logging
+
+import pymongo
+
+import constants as c
+from Database import Database, NEXT_TRAININGS_PROJECTION, get_date_query
+
+logger = logging.getLogger(__name__)
+
+
+def get_copy_request(subtraining: dict) -> pymongo.UpdateOne:
+    """Upsert inserting a copy of an embedded subtraining unless it already exists"""
+    return pymongo.UpdateOne({"date": subtraining["date"], "coach.chat_id": subtraining["coach"]["chat_id"]},
+                             {"$setOnInsert": subtraining}, upsert=True)
+
+
+class SplitDatabase(Database):
+    """Storage of the trainings in a mongo db with every subtraining in its
+    own document of the subtrainings collection, keyed by date and coach.
+    A write only touches the subtraining it changes.
+
+    In the dual mode the subtrainings are still read from the training
+    documents and written to both places, which keeps the bot running
+    while migrate_subtrainings.py copies the existing subtrainings"""
+
+    def __init__(self, config_file, debug_mode: bool, mode="split"):
+        """
+        :param config_file: Path to the config file
+        :param debug_mode: Use the debug collections
+        :param mode: dual or split
+        """
+        if mode not in ("dual", "split"):
+            raise ValueError("Unknown subtraining schema mode {}".format(mode))
+        self.dual = mode == "dual"
+        self.subtrainings = None
+        super().__init__(config_file, debug_mode)
+
+    def connect(self, debug_mode: bool):
+        if not super().connect(debug_mode):
+            return False
+        self.subtrainings = self.database["debug_subtrainings" if debug_mode else "subtrainings"]
+        return True
+
+    def _copy_embedded(self, date: int):
+        """Copy the embedded subtrainings at date that are not copied yet.
+        In the dual mode this runs before a change of the subtrainings, so the
+        change is applied to both places and a later copy by the migration
+        from an older read does not replace it"""
+        training = self.trainings.find_one({"date": date}, {"_id": 0, "subtrainings": 1})
+        if training is not None and len(training.get("subtrainings", [])) > 0:
+            self.subtrainings.bulk_write([get_copy_request(sub) for sub in training["subtrainings"]], ordered=False)
+
+    def _insert_training(self, training: dict):
+        subtrainings = training.get("subtrainings", [])
+        if self.dual:
+            super()._insert_training(training)
+        else:
+            self.trainings.insert_one({k: v for k, v in training.items() if k != "subtrainings"})
+        if len(subtrainings) > 0:
+            self.subtrainings.insert_many([dict(sub) for sub in subtrainings], ordered=False)
+
+    def _insert_missing_trainings(self, trainings: list) -> int:
+        documents = trainings
+        if not self.dual:
+            documents = [{k: v for k, v in training.items() if k != "subtrainings"} for training in trainings]
+        dates = set(training["date"] for training in self._upsert_new_trainings(documents))
+        subtrainings = [dict(sub) for training in trainings if training["date"] in dates
+                        for sub in training.get("subtrainings", [])]
+        if len(subtrainings) > 0:
+            self.subtrainings.insert_many(subtrainings, ordered=False)
+        return len(dates)
+
+    def _move_attendee(self, date: int, attendee: dict, coach_chat_id):
+        if self.dual:
+            self._copy_embedded(date)
+            super()._move_attendee(date, attendee, coach_chat_id)
+        # add first, so the user is never without a subtraining
+        self.subtrainings.update_one(
+            {"date": date, "coach.chat_id": coach_chat_id, "attendees.chat_id": {"$ne": attendee["chat_id"]}},
+            {"$push": {"attendees": attendee}}
+        )
+        self.subtrainings.update_many(
+            {"date": date, "coach.chat_id": {"$ne": coach_chat_id}, "attendees.chat_id": attendee["chat_id"]},
+            {"$pull": {"attendees": {"chat_id": attendee["chat_id"]}}}
+        )
+
+    def _insert_subtraining(self, subtraining: dict) -> bool:
+        if self.dual:
+            if not super()._insert_subtraining(subtraining):
+                return False
+        elif self.trainings.count_documents({"date": subtraining["date"]}, limit=1) == 0:
+            return False
+        try:
+            # the unique index on date and coach rejects a second subtraining of the coach
+            self.subtrainings.insert_one(dict(subtraining))
+        except pymongo.errors.DuplicateKeyError:
+            return self.dual
+        return True
+
+    def _find_subtrainings(self, chat_id, role: int, cutoff=None) -> list:
+        if self.dual:
+            return super()._find_subtrainings(chat_id, role, cutoff)
+        # the subtrainings are indexed by coach and attendee, no reverse index is needed
+        if role == c.COACH:
+            query = {"coach.chat_id": chat_id}
+        else:
+            query = {"attendees.chat_id": chat_id}
+        if cutoff is not None:
+            query["date"] = {"$gt": cutoff}
+        return list(self.subtrainings.find(query, {"_id": 0}).sort("date", pymongo.ASCENDING))
+
+    def _remove_attendee(self, date: int, chat_id):
+        if self.dual:
+            self._copy_embedded(date)
+            super()._remove_attendee(date, chat_id)
+        self.subtrainings.update_many(
+            {"date": date, "attendees.chat_id": chat_id},
+            {"$pull": {"attendees": {"chat_id": chat_id}}}
+        )
+
+    def _remove_subtraining(self, date: int, coach_chat_id):
+        removed = self.subtrainings.find_one_and_delete({"date": date, "coach.chat_id": coach_chat_id},
+                                                        projection={"_id": 0})
+        if self.dual:
+            return super()._remove_subtraining(date, coach_chat_id)
+        return removed
+
+    def iter_next_trainings(self, limit=0, projection=None):
+        if self.dual:
+            yield from super().iter_next_trainings(limit, projection)
+            return
+        if projection is None:
+            projection = NEXT_TRAININGS_PROJECTION
+        now = datetime.datetime.now().timestamp()
+        pipeline = [{"$match": {"date": {"$gt": now}}},
+                    {"$sort": {"date": pymongo.ASCENDING}}]
+        if limit > 0:
+            pipeline.append({"$limit": limit})
+        # leftovers of the embedded schema are replaced by the subtrainings collection
+        pipeline.append({"$project": dict({k: v for k, v in projection.items() if k != "subtrainings"}, _id=1)})
+        if projection.get("subtrainings"):
+            pipeline.append({"$lookup": {"from": self.subtrainings.name, "localField": "date",
+                                         "foreignField": "date", "as": "subtrainings"}})
+        for tr in self.trainings.aggregate(pipeline):
+            tr["date"] = datetime.datetime.fromtimestamp(tr["date"])
+            for sub in tr.get("subtrainings", []):
+                sub.pop("_id", None)
+            yield tr
+
+    def _iter_trainings(self, batch_size: int):
+        if self.dual:
+            yield from super()._iter_trainings(batch_size)
+            return
+        pipeline = [{"$sort": {"date": pymongo.ASCENDING}},
+                    {"$project": {"_id": 0, "subtrainings": 0}},
+                    {"$lookup": {"from": self.subtrainings.name, "localField": "date",
+                                 "foreignField": "date", "as": "subtrainings"}}]
+        for tr in self.trainings.aggregate(pipeline, batchSize=batch_size):
+            for sub in tr["subtrainings"]:
+                sub.pop("_id", None)
+            yield tr
+
+    def _delete_trainings(self, after=None, before=None):
+        self.subtrainings.delete_many(get_date_query(after, before))
+        super()._delete_trainings(after, before)
+
+    def _archive_batch(self, before: float, limit: int) -> list:
+        if self.dual:
+            return super()._archive_batch(before, limit)
+        pipeline = [{"$match": {"date": {"$lt": before}}},
+                    {"$sort": {"date": pymongo.ASCENDING}},
+                    {"$limit": limit},
+                    {"$project": {"_id": 0, "subtrainings": 0}},
+                    {"$lookup": {"from": self.subtrainings.name, "localField": "date",
+                                 "foreignField": "date", "as": "subtrainings"}}]
+        trainings = list(self.trainings.aggregate(pipeline))
+        for tr in trainings:
+            for sub in tr["subtrainings"]:
+                sub.pop("_id", None)
+        return trainings
+
+    def _delete_until(self, date: int):
+        self.subtrainings.delete_many({"date": {"$lte": date}})
+        super()._delete_until(date)
@@ -0,0 +1,135 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+
+from telegram.ext import BasePersistence
+
+import constants as c
+from Training import Training
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state INTEGER,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+def encode_user_data(data: dict) -> str:
+    """Serialise the user_data of a chat, training drafts are stored by their state
+
+    :param data: user_data of the chat
+    :type data: dict
+    :return: json string
+    :rtype: str
+    """
+    return json.dumps({key: value.get_state() if isinstance(value, Training) else value
+                       for key, value in data.items()})
+
+
+def decode_user_data(data: str) -> dict:
+    """Inverse of encode_user_data
+
+    :param data: json string
+    :type data: str
+    :return: user_data of the chat
+    :rtype: dict
+    """
+    user_data = json.loads(data)
+    if user_data.get("training") is not None:
+        user_data["training"] = Training.from_state(user_data["training"])
+    return user_data
+
+
+class SqlitePersistence(BasePersistence):
+    """Persist the conversation states and the user_data of the bot in a sqlite file.
+    Changes are kept in memory and written in one transaction by flush(),
+    which the bot calls every PERSISTENCE_FLUSH_SECONDS and on shutdown"""
+
+    def __init__(self, path=c.PERSISTENCE_FILE):
+        """
+        :param path: Path to the sqlite file
+        """
+        # bot_data holds runtime objects like the scheduler and is never stored
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.dirty_user_data = {}
+        self.dirty_conversations = {}
+
+    @classmethod
+    def replace_bot(cls, obj):
+        # the stored data never contains the bot, skip the deep copy of every update
+        return obj
+
+    def insert_bot(self, obj):
+        return obj
+
+    def get_user_data(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT user_id, data FROM user_data").fetchall()
+        user_data = defaultdict(dict)
+        for user_id, data in rows:
+            try:
+                user_data[user_id] = decode_user_data(data)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error("Dropped unreadable user_data of %s: %s", user_id, e)
+        return user_data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name: str) -> dict:
+        with self.lock:
+            rows = self.connection.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    def update_conversation(self, name: str, key: tuple, new_state):
+        with self.lock:
+            self.dirty_conversations[(name, json.dumps(list(key)))] = new_state
+
+    def update_user_data(self, user_id: int, data: dict):
+        # encode right away, the handlers keep changing the objects in data
+        encoded = encode_user_data(data)
+        with self.lock:
+            self.dirty_user_data[user_id] = encoded
+
+    def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    def update_bot_data(self, data: dict):
+        pass
+
+    def flush(self):
+        """Write all changes since the last flush in one transaction"""
+        with self.lock:
+            if len(self.dirty_user_data) == 0 and len(self.dirty_conversations) == 0:
+                return
+            with self.connection:
+                self.connection.executemany("INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                                            list(self.dirty_user_data.items()))
+                self.connection.executemany("DELETE FROM conversations WHERE name = ? AND key = ?",
+                                            [key for key, state in self.dirty_conversations.items()
+                                             if state is None])
+                self.connection.executemany("INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                            [(name, key, state) for (name, key), state
+                                             in self.dirty_conversations.items() if state is not None])
+            logger.info("Flushed %s user_data and %s conversations",
+                        len(self.dirty_user_data), len(self.dirty_conversations))
+            self.dirty_user_data = {}
+            self.dirty_conversations = {}
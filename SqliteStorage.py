@@ -0,0 +1,372 @@
+import datetime
+import json
+import sqlite3
+import threading
+
+import constants as c
+from Config import get_config
+from Storage import Storage, get_cache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS {prefix}trainings (
+    date INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    link TEXT NOT NULL,
+    attendees TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS {prefix}subtrainings (
+    date INTEGER NOT NULL,
+    coach_chat_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (date, coach_chat_id)
+);
+CREATE INDEX IF NOT EXISTS {prefix}subtrainings_coach ON {prefix}subtrainings (coach_chat_id, date);
+CREATE TABLE IF NOT EXISTS {prefix}attendees (
+    date INTEGER NOT NULL,
+    coach_chat_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (date, coach_chat_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS {prefix}attendees_chat_id ON {prefix}attendees (chat_id, date);
+CREATE TABLE IF NOT EXISTS {prefix}archived_trainings (
+    date INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS {prefix}notifications (
+    chat_id INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    due_at INTEGER NOT NULL,
+    coach_chat_id INTEGER NOT NULL,
+    role INTEGER NOT NULL,
+    sent_at REAL,
+    claim TEXT,
+    PRIMARY KEY (chat_id, date, role, kind)
+);
+CREATE INDEX IF NOT EXISTS {prefix}notifications_due ON {prefix}notifications (sent_at, due_at);
+CREATE INDEX IF NOT EXISTS {prefix}notifications_claim ON {prefix}notifications (claim);
+CREATE TABLE IF NOT EXISTS {prefix}outbox (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {prefix}outbox_next_attempt ON {prefix}outbox (next_attempt_at);
+"""
+
+NOTIFICATION_COLUMNS = ["chat_id", "date", "kind", "due_at", "coach_chat_id", "role"]
+OUTBOX_COLUMNS = ["id", "chat_id", "message", "attempts", "created_at", "next_attempt_at"]
+
+
+class SqliteStorage(Storage):
+    """Storage of the trainings in a local sqlite file. Subtrainings and
+    attendees are kept in own indexed tables, the subtraining data and
+    the user dicts are stored as json"""
+
+    def __init__(self, config_file=c.CONFIG_FILE, debug_mode=False, path=None):
+        """
+        :param config_file: Path to the config file
+        :param debug_mode: Use the debug tables
+        :param path: Path of the sqlite file, defaults to "sqlite-file" of the config file
+        """
+        super().__init__(config_file)
+        if path is None:
+            path = get_config(config_file).get("sqlite-file", c.SQLITE_FILE)
+        self.path = path
+        self.prefix = "debug_" if debug_mode else ""
+        # one connection shared by all threads, serialized by the lock
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self._migrate_ledger()
+            self.connection.executescript(SCHEMA.format(prefix=self.prefix))
+        self.cache = get_cache("sqlite:{}:{}trainings".format(path, self.prefix))
+
+    def execute(self, sql: str, parameters=()):
+        """Run a statement, {prefix} in the statement selects the tables"""
+        return self.connection.execute(sql.format(prefix=self.prefix), parameters)
+
+    def _migrate_ledger(self):
+        """Copy a notification ledger keyed without the role or without
+        the claim column into the current table"""
+        # name: position in the primary key
+        columns = {column[1]: column[5] for column in self.execute("PRAGMA table_info({prefix}notifications)")}
+        if len(columns) == 0 or (columns.get("role", 0) > 0 and "claim" in columns):
+            return
+        copied = ", ".join(NOTIFICATION_COLUMNS + ["sent_at"])
+        self.connection.executescript(
+            "BEGIN; DROP INDEX IF EXISTS {prefix}notifications_due;"
+            "ALTER TABLE {prefix}notifications RENAME TO {prefix}notifications_old;".format(prefix=self.prefix)
+            + SCHEMA.format(prefix=self.prefix)
+            + "INSERT INTO {prefix}notifications ({copied}) SELECT {copied} FROM {prefix}notifications_old;"
+              "DROP TABLE {prefix}notifications_old; COMMIT;".format(prefix=self.prefix, copied=copied))
+
+    def _get_subtraining(self, row) -> dict:
+        """Build a subtraining dict from a (date, coach_chat_id, data) row"""
+        date, coach_chat_id, data = row
+        subtraining = json.loads(data)
+        subtraining["attendees"] = [json.loads(a) for (a,) in self.execute(
+            "SELECT data FROM {prefix}attendees WHERE date = ? AND coach_chat_id = ? ORDER BY rowid",
+            (date, coach_chat_id))]
+        return subtraining
+
+    def _get_training(self, row) -> dict:
+        """Build a training dict from a (date, time, link, attendees) row"""
+        date, time, link, attendees = row
+        subtrainings = [self._get_subtraining(sub) for sub in self.execute(
+            "SELECT date, coach_chat_id, data FROM {prefix}subtrainings WHERE date = ? ORDER BY rowid",
+            (date,)).fetchall()]
+        return {"date": date,
+                "time": time,
+                "link": link,
+                "attendees": json.loads(attendees),
+                "subtrainings": subtrainings}
+
+    def _insert_training(self, training: dict):
+        with self.lock, self.connection:
+            self.execute("INSERT INTO {prefix}trainings (date, time, link, attendees) VALUES (?, ?, ?, ?)",
+                         (training["date"], training["time"], training["link"], json.dumps(training["attendees"])))
+            for subtraining in training["subtrainings"]:
+                self._write_subtraining(subtraining)
+
+    def _insert_missing_trainings(self, trainings: list) -> int:
+        created = 0
+        with self.lock, self.connection:
+            for training in trainings:
+                if self.execute("INSERT OR IGNORE INTO {prefix}trainings (date, time, link, attendees) "
+                                "VALUES (?, ?, ?, ?)", (training["date"], training["time"], training["link"],
+                                                        json.dumps(training["attendees"]))).rowcount == 0:
+                    continue
+                for subtraining in training.get("subtrainings", []):
+                    self._write_subtraining(subtraining)
+                created += 1
+        return created
+
+    def _last_training_date(self):
+        with self.lock:
+            return self.execute("SELECT MAX(date) FROM {prefix}trainings").fetchone()[0]
+
+    def _move_attendee(self, date: int, attendee: dict, coach_chat_id):
+        with self.lock, self.connection:
+            self.execute("DELETE FROM {prefix}attendees WHERE date = ? AND chat_id = ?", (date, attendee["chat_id"]))
+            self.execute("INSERT INTO {prefix}attendees (date, coach_chat_id, chat_id, data) "
+                         "SELECT date, coach_chat_id, ?, ? FROM {prefix}subtrainings "
+                         "WHERE date = ? AND coach_chat_id = ?",
+                         (attendee["chat_id"], json.dumps(attendee), date, coach_chat_id))
+
+    def _add_training_attendee(self, date: int, attendee: dict) -> bool:
+        with self.lock, self.connection:
+            row = self.execute("SELECT attendees FROM {prefix}trainings WHERE date = ?", (date,)).fetchone()
+            if row is None:
+                return False
+            attendees = json.loads(row[0])
+            if attendee["chat_id"] in [a["chat_id"] for a in attendees]:
+                return False
+            attendees.append(attendee)
+            self.execute("UPDATE {prefix}trainings SET attendees = ? WHERE date = ?", (json.dumps(attendees), date))
+            return True
+
+    def _write_subtraining(self, subtraining: dict) -> bool:
+        """Insert a subtraining and its attendees in the transaction of the caller
+
+        :return: False if the coach already has a subtraining at that date
+        """
+        data = dict(subtraining)
+        attendees = data.pop("attendees", [])
+        coach_chat_id = data["coach"]["chat_id"]
+        inserted = self.execute("INSERT OR IGNORE INTO {prefix}subtrainings (date, coach_chat_id, data) "
+                                "VALUES (?, ?, ?)", (data["date"], coach_chat_id, json.dumps(data))).rowcount
+        if inserted == 0:
+            return False
+        for attendee in attendees:
+            self.execute("INSERT INTO {prefix}attendees (date, coach_chat_id, chat_id, data) VALUES (?, ?, ?, ?)",
+                         (data["date"], coach_chat_id, attendee["chat_id"], json.dumps(attendee)))
+        return True
+
+    def _insert_subtraining(self, subtraining: dict) -> bool:
+        with self.lock, self.connection:
+            if self.execute("SELECT 1 FROM {prefix}trainings WHERE date = ?",
+                            (subtraining["date"],)).fetchone() is None:
+                return False
+            return self._write_subtraining(subtraining)
+
+    def _find_subtrainings(self, chat_id, role: int, cutoff=None) -> list:
+        if cutoff is None:
+            cutoff = float("-inf")
+        with self.lock:
+            if role == c.COACH:
+                rows = self.execute("SELECT date, coach_chat_id, data FROM {prefix}subtrainings "
+                                    "WHERE coach_chat_id = ? AND date > ? ORDER BY date", (chat_id, cutoff))
+            else:
+                rows = self.execute("SELECT s.date, s.coach_chat_id, s.data FROM {prefix}attendees a "
+                                    "JOIN {prefix}subtrainings s ON s.date = a.date AND s.coach_chat_id = a.coach_chat_id "
+                                    "WHERE a.chat_id = ? AND a.date > ? ORDER BY a.date", (chat_id, cutoff))
+            return [self._get_subtraining(row) for row in rows.fetchall()]
+
+    def _remove_attendee(self, date: int, chat_id):
+        with self.lock, self.connection:
+            self.execute("DELETE FROM {prefix}attendees WHERE date = ? AND chat_id = ?", (date, chat_id))
+
+    def _remove_subtraining(self, date: int, coach_chat_id):
+        with self.lock, self.connection:
+            row = self.execute("SELECT date, coach_chat_id, data FROM {prefix}subtrainings "
+                               "WHERE date = ? AND coach_chat_id = ?", (date, coach_chat_id)).fetchone()
+            if row is None:
+                return None
+            subtraining = self._get_subtraining(row)
+            self.execute("DELETE FROM {prefix}attendees WHERE date = ? AND coach_chat_id = ?", (date, coach_chat_id))
+            self.execute("DELETE FROM {prefix}subtrainings WHERE date = ? AND coach_chat_id = ?",
+                         (date, coach_chat_id))
+            return subtraining
+
+    def iter_next_trainings(self, limit=0, projection=None):
+        now = datetime.datetime.now().timestamp()
+        with self.lock:
+            rows = self.execute("SELECT date, time, link, attendees FROM {prefix}trainings "
+                                "WHERE date > ? ORDER BY date LIMIT ?", (now, limit if limit > 0 else -1)).fetchall()
+        for row in rows:
+            with self.lock:
+                training = self._get_training(row)
+            training["date"] = datetime.datetime.fromtimestamp(training["date"])
+            yield training
+
+    def _iter_trainings(self, batch_size: int):
+        # one query per batch, the lock is not held while the caller works on a batch
+        last_date = float("-inf")
+        while True:
+            with self.lock:
+                trainings = [self._get_training(row) for row in self.execute(
+                    "SELECT date, time, link, attendees FROM {prefix}trainings WHERE date > ? ORDER BY date LIMIT ?",
+                    (last_date, batch_size)).fetchall()]
+            yield from trainings
+            if len(trainings) < batch_size:
+                return
+            last_date = trainings[-1]["date"]
+
+    def _delete_trainings(self, after=None, before=None):
+        if after is None:
+            after = float("-inf")
+        if before is None:
+            before = float("inf")
+        with self.lock, self.connection:
+            for table in ["attendees", "subtrainings", "trainings"]:
+                self.execute("DELETE FROM {prefix}" + table + " WHERE date > ? AND date < ?", (after, before))
+
+    def _archive_trainings(self, before: float, limit: int) -> int:
+        with self.lock, self.connection:
+            trainings = [self._get_training(row) for row in self.execute(
+                "SELECT date, time, link, attendees FROM {prefix}trainings WHERE date < ? ORDER BY date LIMIT ?",
+                (before, limit)).fetchall()]
+            if len(trainings) == 0:
+                return 0
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO {prefix}archived_trainings (date, data) VALUES (?, ?)".format(
+                    prefix=self.prefix),
+                [(tr["date"], json.dumps(tr)) for tr in trainings])
+            for table in ["attendees", "subtrainings", "trainings"]:
+                self.execute("DELETE FROM {prefix}" + table + " WHERE date <= ?", (trainings[-1]["date"],))
+        return len(trainings)
+
+    def _iter_archive(self, start=None, end=None, batch_size=c.EXPORT_BATCH_SIZE):
+        if start is None:
+            start = float("-inf")
+        if end is None:
+            end = float("inf")
+        while True:
+            with self.lock:
+                rows = self.execute("SELECT date, data FROM {prefix}archived_trainings "
+                                    "WHERE date >= ? AND date < ? ORDER BY date LIMIT ?",
+                                    (start, end, batch_size)).fetchall()
+            for _, data in rows:
+                yield json.loads(data)
+            if len(rows) < batch_size:
+                return
+            # the dates are whole seconds
+            start = rows[-1][0] + 1
+
+    def _ledger_upsert(self, rows: list):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO {prefix}notifications (chat_id, date, kind, due_at, coach_chat_id, role) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (chat_id, date, role, kind) DO UPDATE SET "
+                "due_at = excluded.due_at, coach_chat_id = excluded.coach_chat_id"
+                .format(prefix=self.prefix),
+                [tuple(row[k] for k in NOTIFICATION_COLUMNS) for row in rows])
+
+    def _ledger_delete(self, date=None, chat_ids=None, role=None, after=None, before=None):
+        with self.lock, self.connection:
+            if date is not None:
+                self.connection.executemany(
+                    "DELETE FROM {prefix}notifications WHERE date = ? AND role = ? AND chat_id = ?"
+                    .format(prefix=self.prefix),
+                    [(date, role, chat_id) for chat_id in chat_ids])
+            else:
+                self.execute("DELETE FROM {prefix}notifications WHERE date > ? AND date < ?",
+                             (float("-inf") if after is None else after, float("inf") if before is None else before))
+
+    def _ledger_due(self, now: float) -> list:
+        with self.lock:
+            rows = self.execute("SELECT " + ", ".join(NOTIFICATION_COLUMNS) + " FROM {prefix}notifications "
+                                "WHERE sent_at IS NULL AND due_at <= ? AND date > ? ORDER BY due_at",
+                                (now, now)).fetchall()
+        return [dict(zip(NOTIFICATION_COLUMNS, row), sent_at=None) for row in rows]
+
+    def _ledger_claim_due(self, now: float, claim: str) -> list:
+        with self.lock, self.connection:
+            self.execute("UPDATE {prefix}notifications SET sent_at = ?, claim = ? "
+                         "WHERE sent_at IS NULL AND due_at <= ? AND date > ?", (now, claim, now, now))
+            rows = self.execute("SELECT " + ", ".join(NOTIFICATION_COLUMNS) + " FROM {prefix}notifications "
+                                "WHERE claim = ? ORDER BY due_at", (claim,)).fetchall()
+        return [dict(zip(NOTIFICATION_COLUMNS, row), sent_at=now) for row in rows]
+
+    def _ledger_release(self, rows: list):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE {prefix}notifications SET sent_at = NULL, claim = NULL "
+                "WHERE chat_id = ? AND date = ? AND role = ? AND kind = ?".format(prefix=self.prefix),
+                [(row["chat_id"], row["date"], row["role"], row["kind"]) for row in rows])
+
+    def _ledger_set_sent(self, row: dict, sent_at) -> bool:
+        key = (row["chat_id"], row["date"], row["role"], row["kind"])
+        with self.lock, self.connection:
+            if sent_at is None:
+                return self.execute("UPDATE {prefix}notifications SET sent_at = NULL "
+                                    "WHERE chat_id = ? AND date = ? AND role = ? AND kind = ?", key).rowcount == 1
+            return self.execute("UPDATE {prefix}notifications SET sent_at = ? "
+                                "WHERE chat_id = ? AND date = ? AND role = ? AND kind = ? AND sent_at IS NULL",
+                                (sent_at,) + key).rowcount == 1
+
+    def _ledger_next_due(self, now: float):
+        with self.lock:
+            row = self.execute("SELECT MIN(due_at) FROM {prefix}notifications WHERE sent_at IS NULL AND due_at > ?",
+                               (now,)).fetchone()
+        return row[0]
+
+    def _outbox_insert(self, rows: list):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO {prefix}outbox (chat_id, message, attempts, created_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?, ?)".format(prefix=self.prefix),
+                [(row["chat_id"], row["message"], row["attempts"], row["created_at"], row["next_attempt_at"])
+                 for row in rows])
+
+    def _outbox_claim(self, now: float, lease_until: float, limit: int) -> list:
+        with self.lock, self.connection:
+            rows = self.execute("SELECT " + ", ".join(OUTBOX_COLUMNS) + " FROM {prefix}outbox "
+                                "WHERE next_attempt_at <= ? ORDER BY created_at LIMIT ?", (now, limit)).fetchall()
+            self.connection.executemany(
+                "UPDATE {prefix}outbox SET next_attempt_at = ? WHERE id = ?".format(prefix=self.prefix),
+                [(lease_until, row[0]) for row in rows])
+        return [dict(zip(OUTBOX_COLUMNS, row), next_attempt_at=lease_until) for row in rows]
+
+    def _outbox_delete(self, row_id):
+        with self.lock, self.connection:
+            self.execute("DELETE FROM {prefix}outbox WHERE id = ?", (row_id,))
+
+    def _outbox_retry(self, row_id, attempts: int, next_attempt_at: float):
+        with self.lock, self.connection:
+            self.execute("UPDATE {prefix}outbox SET attempts = ?, next_attempt_at = ? WHERE id = ?",
+                         (attempts, next_attempt_at, row_id))
@@ -0,0 +1,748 @@
+import abc
+import datetime
+import threading
+import time
+import uuid
+
+import constants as c
+from Config import get_config
+from Training import Training, TrainingView
+from User import User
+import util
+
+_storages = {}
+_caches = {}
+# reentrant, the storages call get_cache while open_storage creates them
+_storage_lock = threading.RLock()
+
+
+def open_storage(config_file=c.CONFIG_FILE, debug_mode=c.DEBUG_MODE):
+    """Return the storage backend selected by "storage-backend" in the
+    configuration file (mongo, sqlite or memory). The storage is
+    created on the first call and shared by the whole process
+
+    :param config_file: path to the configuration file
+    :type config_file: str
+    :param debug_mode: use the debug trainings
+    :type debug_mode: bool
+    :return: storage backend
+    :rtype: Storage
+    """
+    backend = get_config(config_file).get("storage-backend", c.STORAGE_BACKEND)
+    key = (config_file, backend, debug_mode)
+    with _storage_lock:
+        if key not in _storages:
+            if backend == "mongo":
+                schema = get_config(config_file).get("subtraining-schema", c.SUBTRAINING_SCHEMA)
+                if schema == "embedded":
+                    from Database import Database
+                    _storages[key] = Database(config_file, debug_mode=debug_mode)
+                else:
+                    from SplitDatabase import SplitDatabase
+                    _storages[key] = SplitDatabase(config_file, debug_mode=debug_mode, mode=schema)
+            elif backend == "sqlite":
+                from SqliteStorage import SqliteStorage
+                _storages[key] = SqliteStorage(config_file, debug_mode=debug_mode)
+            elif backend == "memory":
+                from MemoryStorage import MemoryStorage
+                _storages[key] = MemoryStorage(config_file, debug_mode=debug_mode)
+            else:
+                raise ValueError("Unknown storage backend {}".format(backend))
+        return _storages[key]
+
+
+def get_cache(name: str):
+    """Return the upcoming trainings cache of a collection,
+    shared by all storages of the process
+
+    :param name: unique name of the collection
+    :type name: str
+    :rtype: TrainingCache
+    """
+    with _storage_lock:
+        return _caches.setdefault(name, TrainingCache())
+
+
+def get_version(versions: tuple, date) -> tuple:
+    """Version of the training at date in a snapshot of Storage.get_versions().
+    It changes with every write to the training
+
+    :param versions: snapshot of the write counters
+    :type versions: tuple
+    :param date: unix timestamp or datetime of the training
+    :return: hashable version
+    :rtype: tuple
+    """
+    if isinstance(date, datetime.datetime):
+        date = date.timestamp()
+    epoch, dates = versions
+    return epoch, dates.get(int(date), 0)
+
+
+def get_training_dict(training_date: datetime.date, time: str) -> dict:
+    """Build a new training dict with a unix timestamp and a random meeting link
+
+    :param training_date: day of the training
+    :type training_date: datetime.date
+    :param time: time of the training in 24h format
+    :type time: str
+    :rtype: dict
+    """
+    # make a correct date out of date and time
+    training_date = datetime.datetime(
+        training_date.year,
+        training_date.month,
+        training_date.day,
+        int(time.split(':')[0]),
+        int(time.split(':')[1])
+    )
+    return {
+        # create a unix timestamp
+        "date": int(training_date.strftime("%s")),
+        "time": time,
+        "attendees": [],
+        "subtrainings": [],
+        "link": c.MEETING_BASE_URL + util.get_random_string(num_of_chars=c.RANDOM_STR_LEN)
+    }
+
+
+def get_schedule(training_settings: list, first_day: datetime.date, number_of_days: int) -> list:
+    """Build the trainings of the weekly slots in the number_of_days days from first_day
+
+    :param training_settings: list of dicts with weekday and time, see Config.get_trainings
+    :type training_settings: list
+    :return: training dicts sorted by date
+    :rtype: list
+    """
+    trainings = []
+    for i in range(number_of_days):
+        day = first_day + datetime.timedelta(i)
+        for training in training_settings:
+            if day.weekday() == training["weekday"]:
+                trainings.append(get_training_dict(day, training["time"]))
+    trainings.sort(key=lambda training: training["date"])
+    return trainings
+
+
+def get_ledger_rows(date: int, chat_id, coach_chat_id, role: int) -> list:
+    """Build the notification ledger rows of a user in a training
+
+    :param date: unix timestamp of the training
+    :type date: int
+    :return: one row for each reminder kind (far and now)
+    :rtype: list
+    """
+    return [{"chat_id": chat_id,
+             "date": date,
+             "kind": kind,
+             "due_at": date - int(delta.total_seconds()),
+             "coach_chat_id": coach_chat_id,
+             "role": role}
+            for kind, delta in [("far", c.NEXT_TRAINING_NOTIFY_FAR), ("now", c.NEXT_TRAINING_NOTIFY_NOW)]]
+
+
+class TrainingCache:
+    """Cache of the upcoming trainings of one collection"""
+
+    def __init__(self, ttl=c.TRAINING_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key: (expiry, list of training dicts, set of unix timestamps)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # write counters of the training dates and of invalidate() without a date
+        self.versions = {}
+        self.epoch = 0
+
+    def get(self, key):
+        """Return the cached trainings or None if missing, expired
+        or the first training already started"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expiry, trainings, _ = entry
+                if time.monotonic() < expiry and \
+                        (len(trainings) == 0 or trainings[0]["date"] > datetime.datetime.now()):
+                    self.hits += 1
+                    return list(trainings)
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def get_generation(self) -> int:
+        """Number of invalidations so far, take it before reading the
+        trainings of a miss and pass it to put
+
+        :rtype: int
+        """
+        with self.lock:
+            return self.invalidations
+
+    def put(self, key, trainings: list, generation: int):
+        """Cache the trainings unless they were invalidated since generation,
+        then they may already be outdated
+
+        :param generation: get_generation() taken before the trainings were read
+        :type generation: int
+        """
+        dates = set(int(tr["date"].timestamp()) for tr in trainings)
+        with self.lock:
+            if generation != self.invalidations:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, list(trainings), dates)
+
+    def invalidate(self, date=None):
+        """Drop the entries containing the training at date or all entries
+
+        :param date: unix timestamp of the changed training, None drops everything
+        :type date: int
+        """
+        with self.lock:
+            self.invalidations += 1
+            if date is None:
+                self.epoch += 1
+                self.entries.clear()
+                return
+            self.versions[int(date)] = self.versions.get(int(date), 0) + 1
+            for key in [k for k, (_, _, dates) in self.entries.items() if int(date) in dates]:
+                del self.entries[key]
+
+    def get_versions(self) -> tuple:
+        """Snapshot of the write counters, see get_version
+
+        :return: epoch and the versions of all changed training dates
+        :rtype: tuple
+        """
+        with self.lock:
+            return self.epoch, dict(self.versions)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "entries": len(self.entries)}
+
+
+class Storage(abc.ABC):
+    """Storage of the trainings. The public methods are shared by all
+    backends, which only implement the underscore methods working on
+    plain training and subtraining dicts"""
+
+    def __init__(self, config_file=c.CONFIG_FILE):
+        self.config_file = config_file
+        self.cache = None
+
+    def cache_stats(self) -> dict:
+        """Return hit and miss counters of the upcoming trainings cache
+
+        :return: counters of the cache shared by all storages of the collection
+        :rtype: dict
+        """
+        return self.cache.get_stats()
+
+    def add_training(self, training_date, time):
+        """add one training to the database with a unix timestamp
+        and a random meeting link
+
+        :param training_date: day of the new training
+        :type training_date: datetime.date object
+        :param time: time of the training in 24h format
+        :type time: str
+        """
+        self._insert_training(get_training_dict(training_date, time))
+        self.cache.invalidate()
+
+    def subtraining_add_attendee(self, attendee: User, date: int, coach: User):
+        """add an attendee to a subtraining"""
+        self._move_attendee(date, attendee.get_dict(), coach.get_chat_id())
+        self._ledger_upsert(get_ledger_rows(date, attendee.get_chat_id(), coach.get_chat_id(), c.ATTENDEE))
+        self.cache.invalidate(date)
+        return "user removed from all other trainings and added to desired subtraining"
+
+    def training_add_attendee(self, attendee: User, date: int):
+        """add an attendee to a training"""
+        added = self._add_training_attendee(date, attendee.get_dict())
+        self.cache.invalidate(date)
+        if not added:
+            return "user already is attendee"
+        return "user was added"
+
+    def add_subtraining(self, training: Training):
+        """Add a subtraining to the database, only if the given
+        user has not signed in a training yet that day.
+        Also give the subtraining a random meeting link
+
+        :param training: Training object with user chosen data
+        :type training: Training
+        :return: Returns False if training already set by user
+        :rtype: bool
+        """
+        training_data = training.get_dict()
+        # add random link to database
+        training_data["link"] = c.MEETING_BASE_URL + util.get_random_string(num_of_chars=c.RANDOM_STR_LEN)
+        added = self._insert_subtraining(training_data)
+        if added:
+            coach_chat_id = training_data["coach"]["chat_id"]
+            self._ledger_upsert(get_ledger_rows(training_data["date"], coach_chat_id, coach_chat_id, c.COACH))
+        self.cache.invalidate(training_data["date"])
+        return added
+
+    def get_my_trainings(self, user: User, role: int, offset=datetime.timedelta(seconds=0)) -> list:
+        """return all the subtrainings the user is
+        in as specified in the role
+
+        :param role: Specify the role of the user (can be COACH or ATTENDEE)
+        :type role: int
+        :param user: string with username
+        :type user: str
+        :param offset: Timedelta, how long a training can be in the past to be still shown
+        :type offset: datetime.timedelta
+        :return: returns the subtrainings as a list of dicts
+        :rtype: list
+        """
+        if role not in (c.COACH, c.ATTENDEE):
+            return []
+        cutoff = (datetime.datetime.now() - offset).timestamp()
+        # take the versions first, a write in between must not be hidden behind a new version
+        versions = self.get_versions()
+        return [TrainingView(sub, get_version(versions, sub["date"]))
+                for sub in self._find_subtrainings(user.get_chat_id(), role, cutoff)]
+
+    def get_subtrainings(self, user: User) -> list:
+        """get all subtrainings for a user
+
+        :param user: user object
+        :type user: obj
+        :return: list of dicts with all subtrainings
+        :rtype: list
+        """
+        versions = self.get_versions()
+        return [TrainingView(sub, get_version(versions, sub["date"]))
+                for sub in self._find_subtrainings(user.get_chat_id(), c.ATTENDEE)]
+
+    def cancel_subtrainings(self, date: int, user: User):
+        """remove user from the subtraining
+
+        :param date: date as unix-timestamp
+        :type date: int
+        :param user: user object
+        :type user: user
+        :return: return success message
+        :rtype: str
+        """
+        self._remove_attendee(date, user.get_chat_id())
+        self._ledger_delete(date=date, chat_ids=[user.get_chat_id()], role=c.ATTENDEE)
+        self.cache.invalidate(date)
+        return "user was removed"
+
+    def remove_training_of_coach(self, coach: User, date: int) -> TrainingView:
+        """remove training by coach username and date. Return data of
+        the deleted training
+
+        :param coach: object of type Coach
+        :type coach: object
+        :param date: date as int unix timestamp
+        :type date: int
+        :return: view of the deleted training
+        :rtype: TrainingView
+        """
+        removed_subtraining = self._remove_subtraining(date, coach.get_chat_id())
+        self.cache.invalidate(date)
+        if removed_subtraining is None:
+            return None
+        self._ledger_delete(date=date, chat_ids=[coach.get_chat_id()], role=c.COACH)
+        self._ledger_delete(date=date, chat_ids=[a["chat_id"] for a in removed_subtraining["attendees"]],
+                            role=c.ATTENDEE)
+        return TrainingView(removed_subtraining)
+
+    def create_trainings(self, number_of_days: int, extend=False) -> int:
+        """Read training weekdays and time from the config file and
+        Create all trainings accordingly for the time period of the
+        next n days. Existing trainings are kept, so running it again
+        only adds the missing dates
+
+        :param number_of_days: How many days ahead trainings get created
+        :type number_of_days: int
+        :param extend: Only write the dates after the last existing training
+        :type extend: bool
+        :return: number of created trainings
+        :rtype: int
+        """
+        # get the weekdays from the config file
+        training_settings = get_config(self.config_file).get_trainings()
+        trainings = get_schedule(training_settings, datetime.date.today(), number_of_days)
+        if extend:
+            last_date = self._last_training_date()
+            if last_date is not None:
+                trainings = [training for training in trainings if training["date"] > last_date]
+        if len(trainings) == 0:
+            return 0
+        created = self._insert_missing_trainings(trainings)
+        self.cache.invalidate()
+        return created
+
+    def get_versions(self) -> tuple:
+        """Snapshot of the write counters of the trainings. Take it before
+        reading the trainings and pass it to get_version to key rendered text
+
+        :return: snapshot for get_version
+        :rtype: tuple
+        """
+        return self.cache.get_versions()
+
+    def next_trainings(self, number_of_trainings=0, all=False):
+        """return the next n trainings from the database as a
+        list of dicts
+
+        :param number_of_trainings: How many trainings will be returned
+        :type number_of_trainings: int
+        :param all: Return all future trainings
+        :type all: bool
+        :return: the trainings as a List of dicts
+        :rtype: list of dicts
+        """
+        if not all and number_of_trainings <= 0:
+            return []
+        limit = 0 if all else number_of_trainings
+        # the returned dicts are shared with the cache and must not be modified
+        generation = self.cache.get_generation()
+        trainings = self.cache.get(limit)
+        if trainings is None:
+            trainings = list(self.iter_next_trainings(limit=limit))
+            self.cache.put(limit, trainings, generation)
+        return trainings
+
+    @abc.abstractmethod
+    def iter_next_trainings(self, limit=0, projection=None):
+        """Lazily yield the future trainings sorted by date.
+        The date of each training is converted to a datetime object
+
+        :param limit: Maximum number of trainings, 0 means no limit
+        :type limit: int
+        :param projection: Fields to return, backends may return more
+        :type projection: dict
+        :return: generator of training dicts
+        """
+
+    def delete_all_trainings(self):
+        """delete all training database entries
+        """
+        self.delete_trainings()
+
+    def delete_future_trainings(self):
+        """delete all trainings in the future
+        """
+        self.delete_trainings(after=datetime.datetime.now().timestamp())
+
+    def delete_trainings(self, after=None, before=None):
+        """delete the trainings between two unix timestamps with a range
+        delete, without reading them first
+
+        :param after: only trainings after this unix timestamp, None means no limit
+        :type after: float
+        :param before: only trainings before this unix timestamp, None means no limit
+        :type before: float
+        """
+        self._delete_trainings(after=after, before=before)
+        self._ledger_delete(after=after, before=before)
+        self.cache.invalidate()
+
+    def iter_trainings(self, archived=False, batch_size=c.EXPORT_BATCH_SIZE):
+        """Lazily yield all trainings with their subtrainings sorted by date,
+        e.g. to export them. The dates stay unix timestamps
+
+        :param archived: read the archive instead of the current trainings
+        :type archived: bool
+        :param batch_size: trainings fetched per round trip
+        :type batch_size: int
+        :return: generator of training dicts
+        """
+        if archived:
+            return self._iter_archive(batch_size=batch_size)
+        return self._iter_trainings(batch_size)
+
+    def import_trainings(self, trainings: list) -> int:
+        """Store trainings with their subtrainings, e.g. from an export.
+        Trainings at an existing date are skipped
+
+        :param trainings: training dicts with unix timestamps
+        :type trainings: list
+        :return: number of imported trainings
+        :rtype: int
+        """
+        if len(trainings) == 0:
+            return 0
+        imported = self._insert_missing_trainings(trainings)
+        self.cache.invalidate()
+        return imported
+
+    def archive_trainings(self, max_age: datetime.timedelta, batch_size=c.ARCHIVE_BATCH_SIZE) -> int:
+        """Move the trainings older than max_age with their subtrainings
+        into the archive, batch_size trainings at a time. The other methods
+        only see the remaining trainings, see iter_archived_trainings
+
+        :param max_age: age of the oldest training that is kept
+        :type max_age: datetime.timedelta
+        :param batch_size: trainings moved per round trip
+        :type batch_size: int
+        :return: number of archived trainings
+        :rtype: int
+        """
+        before = (datetime.datetime.now() - max_age).timestamp()
+        archived = 0
+        while True:
+            moved = self._archive_trainings(before, batch_size)
+            archived += moved
+            if moved < batch_size:
+                break
+        self._ledger_delete(before=before)
+        return archived
+
+    def iter_archived_trainings(self, start=None, end=None):
+        """Lazily yield the archived trainings sorted by date, e.g. for statistics.
+        The date of each training is converted to a datetime object
+
+        :param start: first date, None starts with the oldest training
+        :type start: datetime.datetime
+        :param end: only trainings before this date, None means no limit
+        :type end: datetime.datetime
+        :return: generator of training dicts
+        """
+        start = None if start is None else start.timestamp()
+        end = None if end is None else end.timestamp()
+        for training in self._iter_archive(start, end):
+            training["date"] = datetime.datetime.fromtimestamp(training["date"])
+            yield training
+
+    def due_notifications(self, now=None) -> list:
+        """Return the unsent reminders that are due, oldest first
+
+        :param now: unix timestamp, defaults to now
+        :type now: float
+        :return: ledger rows as dicts with chat_id, date, kind, due_at, coach_chat_id and role
+        :rtype: list
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        return self._ledger_due(now)
+
+    def claim_due_notifications(self, now=None) -> list:
+        """Mark all unsent reminders that are due as sent in one write and
+        return them. Only the caller that claimed a reminder may send it
+
+        :param now: unix timestamp, defaults to now
+        :type now: float
+        :return: claimed ledger rows, oldest first
+        :rtype: list
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        return self._ledger_claim_due(now, uuid.uuid4().hex)
+
+    def release_notifications(self, rows: list):
+        """Mark claimed reminders as unsent again in one write, e.g. after the delivery failed
+
+        :param rows: ledger rows returned by claim_due_notifications
+        :type rows: list
+        """
+        if len(rows) > 0:
+            self._ledger_release(rows)
+
+    def next_notification_due(self, now=None):
+        """Return when the next unsent reminder becomes due
+
+        :param now: unix timestamp, defaults to now
+        :type now: float
+        :return: unix timestamp or None if no reminder is pending
+        """
+        if now is None:
+            now = datetime.datetime.now().timestamp()
+        return self._ledger_next_due(now)
+
+    def rebuild_notification_ledger(self):
+        """Create the ledger rows of all future trainings. Reminders
+        flagged as sent in trainings of versions before the ledger
+        are marked as sent"""
+        for training in self.iter_next_trainings():
+            date = int(training["date"].timestamp())
+            for sub in training["subtrainings"]:
+                users = [(sub["coach"], c.COACH)] + [(att, c.ATTENDEE) for att in sub["attendees"]]
+                for user, role in users:
+                    rows = get_ledger_rows(date, user["chat_id"], sub["coach"]["chat_id"], role)
+                    self._ledger_upsert(rows)
+                    for row in rows:
+                        if user.get("notified_" + row["kind"], False):
+                            self._ledger_set_sent(row, date)
+
+    def enqueue_messages(self, messages: list):
+        """Append messages to the outbox, they are sent in the background
+
+        :param messages: list of (chat_id, message) tuples
+        :type messages: list
+        """
+        now = datetime.datetime.now().timestamp()
+        self._outbox_insert([{"chat_id": chat_id,
+                              "message": message,
+                              "attempts": 0,
+                              "created_at": now,
+                              "next_attempt_at": now} for chat_id, message in messages])
+
+    def claim_messages(self, limit=c.OUTBOX_BATCH_SIZE) -> list:
+        """Take the next due messages of the outbox. They are hidden
+        from other senders for OUTBOX_LEASE_SECONDS
+
+        :param limit: maximum number of messages
+        :type limit: int
+        :return: outbox rows with id, chat_id, message and attempts
+        :rtype: list
+        """
+        now = datetime.datetime.now().timestamp()
+        return self._outbox_claim(now, now + c.OUTBOX_LEASE_SECONDS, limit)
+
+    def complete_message(self, row: dict):
+        """Remove a delivered message from the outbox"""
+        self._outbox_delete(row["id"])
+
+    def retry_message(self, row: dict) -> bool:
+        """Schedule another attempt with exponential backoff or drop
+        the message after OUTBOX_MAX_ATTEMPTS attempts
+
+        :return: False if the message was dropped
+        :rtype: bool
+        """
+        attempts = row["attempts"] + 1
+        if attempts >= c.OUTBOX_MAX_ATTEMPTS:
+            self._outbox_delete(row["id"])
+            return False
+        next_attempt_at = datetime.datetime.now().timestamp() + c.OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1)
+        self._outbox_retry(row["id"], attempts, next_attempt_at)
+        return True
+
+    @abc.abstractmethod
+    def _insert_training(self, training: dict):
+        """Store a new training dict"""
+
+    @abc.abstractmethod
+    def _insert_missing_trainings(self, trainings: list) -> int:
+        """Store the training dicts and their subtrainings whose date
+        does not exist yet in one batch
+
+        :return: number of inserted trainings
+        """
+
+    @abc.abstractmethod
+    def _last_training_date(self):
+        """Return the unix timestamp of the last training or None"""
+
+    @abc.abstractmethod
+    def _move_attendee(self, date: int, attendee: dict, coach_chat_id):
+        """Remove the attendee from all subtrainings at date and
+        add them to the subtraining of the coach"""
+
+    @abc.abstractmethod
+    def _add_training_attendee(self, date: int, attendee: dict) -> bool:
+        """Add an attendee to the training at date
+
+        :return: False if the user already is an attendee
+        """
+
+    @abc.abstractmethod
+    def _insert_subtraining(self, subtraining: dict) -> bool:
+        """Add the subtraining to its training
+
+        :return: False if the coach already has a subtraining at that date
+        """
+
+    @abc.abstractmethod
+    def _find_subtrainings(self, chat_id, role: int, cutoff=None) -> list:
+        """Return the subtrainings dicts of a coach or attendee sorted by date
+
+        :param cutoff: only subtrainings after this unix timestamp
+        """
+
+    @abc.abstractmethod
+    def _remove_attendee(self, date: int, chat_id):
+        """Remove the attendee from all subtrainings at date"""
+
+    @abc.abstractmethod
+    def _remove_subtraining(self, date: int, coach_chat_id):
+        """Remove the subtraining of the coach at date
+
+        :return: removed subtraining dict or None
+        """
+
+    @abc.abstractmethod
+    def _delete_trainings(self, after=None, before=None):
+        """Delete the trainings after and before unix timestamps,
+        all trainings if no argument is given"""
+
+    @abc.abstractmethod
+    def _archive_trainings(self, before: float, limit: int) -> int:
+        """Move up to limit of the oldest trainings before a unix timestamp
+        with their subtrainings into the archive
+
+        :return: number of moved trainings
+        """
+
+    @abc.abstractmethod
+    def _iter_archive(self, start=None, end=None, batch_size=c.EXPORT_BATCH_SIZE):
+        """Yield the archived training dicts with start <= date < end sorted by date"""
+
+    @abc.abstractmethod
+    def _iter_trainings(self, batch_size: int):
+        """Yield all training dicts with their subtrainings sorted by date,
+        reading batch_size trainings at a time"""
+
+    @abc.abstractmethod
+    def _ledger_upsert(self, rows: list):
+        """Insert ledger rows keyed by chat_id, date, role and kind. Existing
+        rows keep their sent state but get the coach_chat_id and due_at of the new row"""
+
+    @abc.abstractmethod
+    def _ledger_delete(self, date=None, chat_ids=None, role=None, after=None, before=None):
+        """Delete the ledger rows of the chat_ids in the role at date, the rows
+        after and before unix timestamps or all rows if no argument is given"""
+
+    @abc.abstractmethod
+    def _ledger_due(self, now: float) -> list:
+        """Return the unsent rows due at now of trainings after now"""
+
+    @abc.abstractmethod
+    def _ledger_claim_due(self, now: float, claim: str) -> list:
+        """Set sent_at of the unsent rows due at now of trainings after now
+        and return the rows changed by this call, tagged with claim"""
+
+    @abc.abstractmethod
+    def _ledger_release(self, rows: list):
+        """Reset sent_at of the rows"""
+
+    @abc.abstractmethod
+    def _ledger_set_sent(self, row: dict, sent_at) -> bool:
+        """Set sent_at of the row. A timestamp is only set on unsent rows
+
+        :return: True if the row was changed
+        """
+
+    @abc.abstractmethod
+    def _ledger_next_due(self, now: float):
+        """Return the smallest due_at after now of the unsent rows"""
+
+    @abc.abstractmethod
+    def _outbox_insert(self, rows: list):
+        """Store new outbox rows"""
+
+    @abc.abstractmethod
+    def _outbox_claim(self, now: float, lease_until: float, limit: int) -> list:
+        """Set next_attempt_at of up to limit rows due at now to lease_until
+        and return them, oldest first, with their id"""
+
+    @abc.abstractmethod
+    def _outbox_delete(self, row_id):
+        """Delete an outbox row"""
+
+    @abc.abstractmethod
+    def _outbox_retry(self, row_id, attempts: int, next_attempt_at: float):
+        """Set the attempts and next_attempt_at of an outbox row"""
@@ -6,8 +6,7 @@ from telegram.ext import CallbackContext
 
 import constants as c
 import util
-from User import User
-from Notifier import Notifier
+from User import User, UserView
 
 logging.basicConfig(
     format=c.LOG_FORMAT, level=logging.INFO, filename="coachbot.log"
@@ -41,14 +40,40 @@ class Training:
         self.possible_dates = []
 
     def get_dict(self):
-        att = []
         return {"date": int(self.get_date("%s")),
                 "coach": self.coach.get_dict(),
                 "title": self.title,
                 "description": self.description,
-                "attendees": [att.append(a.get_dict()) for a in self.get_attendees()],
+                "attendees": [a.get_dict() for a in self.attendees],
                 "time": self.get_date("%H:%M")}
 
+    def get_state(self) -> dict:
+        """
+        Get the state of a training that is being created, it contains only json types.
+        :return: State dict, see from_state
+        """
+        return {"coach": self.coach.get_dict() if self.coach is not None else None,
+                "date": int(self.date.timestamp()) if self.date is not None else None,
+                "title": self.title,
+                "description": self.description,
+                "attendees": [a.get_dict() for a in self.attendees],
+                "possible_dates": [int(d.timestamp()) for d in self.possible_dates]}
+
+    @staticmethod
+    def from_state(state: dict):
+        """
+        Restore a training from its state.
+        :param state: State dict of get_state
+        :return: Training object
+        """
+        training = Training(coach=User(from_dict=state["coach"]) if state["coach"] is not None else None,
+                            date=datetime.datetime.fromtimestamp(state["date"]) if state["date"] is not None else None,
+                            title=state["title"],
+                            description=state["description"],
+                            attendees=[User(from_dict=a) for a in state["attendees"]])
+        training.possible_dates = [datetime.datetime.fromtimestamp(d) for d in state["possible_dates"]]
+        return training
+
     def set_coach(self, coach: User):
         """
         Set the coach of a training.
@@ -84,6 +109,13 @@ class Training:
         """
         return self.attendees
 
+    def get_attendee_count(self) -> int:
+        """
+        Get the number of attendees.
+        :return: Number of attendees
+        """
+        return len(self.attendees)
+
     def get_possible_dates(self) -> list:
         """
         Get a list of dates of the possible list of training dates.
@@ -134,7 +166,7 @@ class Training:
         :param update: Chat bot update object
         :param context: Chat bot context
         """
-        db = context.user_data["db"]
+        db = util.get_db(context)
         user = User(update.message.chat_id, update.message.from_user)
         next_trainings_all = db.next_trainings(number_of_trainings=c.FUTURE_TRAININGS)
         next_trainings = []
@@ -299,8 +331,9 @@ class Training:
         if update.message.text == "/{}".format(c.CMD_YES):
             msg = "Trainingsdaten werden übermittelt. Herzlichen Glückwunsch zum Training!"
             update.message.reply_text(msg)
-            db = context.user_data["db"]
+            db = util.get_db(context)
             db.add_subtraining(training)
+            util.poke_scheduler(context)
             if len(training.get_description().strip()) > 0:
                 description = "*Beschreibung: *" + training.get_description().strip() + "\n\n"
             else:
@@ -312,11 +345,74 @@ class Training:
                                 training.get_title() + "\n" + \
                                 description + \
                                 "Schreibe @gymnastics\_coach\_bot um dich anzumelden."
-            notifier = Notifier()
-            notifier.notify(message=broadcast_message, chat_id=context.user_data["channel_id"])
+            util.send_later(context, [(context.user_data["channel_id"], broadcast_message)])
             util.action_selector(update, context)
             logger.info("Training data submitted to the database")
             return c.START
         else:
             training.check(update)
             return c.TRAINING_CHECK
+
+
+class TrainingView:
+    """Read-only Training over a subtraining dict of the storage.
+    The date, the coach and the attendees are decoded on first access"""
+    __slots__ = ("doc", "version", "_date", "_coach", "_attendees")
+
+    def __init__(self, doc: dict, version=None):
+        """
+        :param doc: Subtraining dict
+        :param version: Version of the training, see Storage.get_version
+        """
+        self.doc = doc
+        self.version = version
+        self._date = None
+        self._coach = None
+        self._attendees = None
+
+    @property
+    def date(self) -> datetime.datetime:
+        if self._date is None:
+            self._date = datetime.datetime.fromtimestamp(self.doc["date"])
+        return self._date
+
+    def get_date(self, format_str="%s") -> str:
+        """
+        Return the training date as string.
+        :param format_str: Specifies the format of the output
+        :return: String representing the training date
+        """
+        return self.date.strftime(format_str)
+
+    def get_coach(self) -> UserView:
+        if self._coach is None:
+            self._coach = UserView(self.doc["coach"])
+        return self._coach
+
+    def get_title(self) -> str:
+        return self.doc["title"]
+
+    def get_description(self) -> str:
+        return self.doc["description"]
+
+    def get_attendees(self) -> list:
+        """
+        Get a list of all attendees
+        :return: List of attendees as list of UserView objects
+        """
+        if self._attendees is None:
+            self._attendees = [UserView(a) for a in self.doc["attendees"]]
+        return self._attendees
+
+    def get_attendee_count(self) -> int:
+        """
+        Get the number of attendees without decoding them.
+        :return: Number of attendees
+        """
+        return len(self.doc["attendees"])
+
+    def get_version(self):
+        return self.version
+
+    def get_dict(self) -> dict:
+        return self.doc
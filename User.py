@@ -19,9 +19,11 @@ class User:
             self.role = from_dict["role"]
 
     def __eq__(self, other):
-        return (self.chat_id == other.chat_id and
-                self.user_name == other.user_name and
-                self.full_name == other.full_name)
+        if not isinstance(other, (User, UserView)):
+            return NotImplemented
+        return (self.get_chat_id() == other.get_chat_id() and
+                self.get_user_name() == other.get_user_name() and
+                self.get_full_name() == other.get_full_name())
 
     def set_chat_id(self, chat_id):
         self.chat_id = chat_id
@@ -60,3 +62,37 @@ class User:
                 "notified_far": self.notified_far,
                 "notified_now": self.notified_now,
                 "role": self.role}
+
+
+class UserView:
+    """Read-only User over a user dict of the storage, nothing is copied"""
+    __slots__ = ("doc",)
+
+    def __init__(self, doc: dict):
+        self.doc = doc
+
+    __eq__ = User.__eq__
+
+    def get_chat_id(self):
+        return self.doc["chat_id"]
+
+    def get_user_name(self):
+        return self.doc["user_name"]
+
+    def get_full_name(self):
+        return self.doc["full_name"]
+
+    def is_notified_now(self):
+        return self.doc["notified_now"]
+
+    def is_notified_far(self):
+        return self.doc["notified_far"]
+
+    def is_attendee(self):
+        return self.doc["role"] == c.ATTENDEE
+
+    def is_coach(self):
+        return self.doc["role"] == c.COACH
+
+    def get_dict(self) -> dict:
+        return self.doc
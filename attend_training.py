@@ -5,8 +5,8 @@ from telegram.ext import CallbackContext
 
 import constants as c
 import util
-from User import User
-from Training import Training
+from Storage import get_version
+from User import User, UserView
 
 logging.basicConfig(
     format=c.LOG_FORMAT, level=logging.INFO, filename="coachbot.log"
@@ -14,6 +14,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def render_subtraining(st: dict) -> str:
+    """
+    Render a subtraining for the overview of bot_attend, without its command.
+    :param st: Subtraining dict
+    :return: HTML text
+    """
+    msg = "{}\n".format(st["title"])
+    msg += "<u>Trainer:</u> {}\n".format(st["coach"]["full_name"])
+    if len(st["description"].strip()) > 0:
+        msg += "<u>Info:</u> {}\n".format(st["description"])
+    msg += "<u>Anzahl Teilnehmer:</u> {}\n".format(len(st["attendees"]))
+    return msg + "\n"
+
+
 def bot_attend(update: Update, context: CallbackContext) -> int:
     """
     Display an overview of all available trainings and subtrainings
@@ -25,32 +39,32 @@ def bot_attend(update: Update, context: CallbackContext) -> int:
 
     # Get database data
     db = util.get_db(context)
+    versions = db.get_versions()
     next_trainings = db.next_trainings(number_of_trainings=c.FUTURE_TRAININGS)
 
     commands = []
-    msg = "An welchem Training möchtest du teilnehmen?\n\n"
+    parts = ["An welchem Training möchtest du teilnehmen?\n\n"]
 
     # Build string to display all trainings and subtrainings
     idx = 1
     for t in next_trainings:
-        msg += "<b>{}. Training am {}</b>\n".format(idx, t["date"].strftime(c.DATE_FORMAT))
+        date = int(t["date"].timestamp())
+        version = get_version(versions, date)
+        parts.append("<b>{}. Training am {}</b>\n".format(
+            idx, util.get_fragment(("date", date), 0, lambda: t["date"].strftime(c.DATE_FORMAT))))
         sub_idx = 1
         sub_trainings = t["subtrainings"]
         if len(sub_trainings) == 0:
-            msg += "Noch keine Trainings vorhanden\n"
+            parts.append("Noch keine Trainings vorhanden\n")
         for st in t["subtrainings"]:
-            subtraining = Training(from_dict=st)
             command = "/training_{}_{}".format(idx, sub_idx)
             commands.append([command])
-            msg += "{}: {}\n".format(command, st["title"])
-            description = st["description"]
-            msg += "<u>Trainer:</u> {}\n".format(st["coach"]["full_name"])
-            if len(description.strip()) > 0:
-                msg += "<u>Info:</u> {}\n".format(st["description"])
-            msg += "<u>Anzahl Teilnehmer:</u> {}\n".format(len(subtraining.get_attendees()))
-            msg += "\n"
+            parts.append("{}: ".format(command))
+            parts.append(util.get_fragment(("attend", date, st["coach"]["chat_id"]), version,
+                                           lambda: render_subtraining(st)))
             sub_idx += 1
         idx += 1
+    msg = "".join(parts)
 
     commands.append(["/{}".format(c.CMD_CANCEL)])
     update.message.reply_text(
@@ -90,9 +104,10 @@ def bot_attend_save(update: Update, context: CallbackContext) -> int:
     date = training["date"]
     training_date = int(date.strftime("%s"))
 
-    coach = User(from_dict=sub_training["coach"])
+    coach = UserView(sub_training["coach"])
     # Add the user as attendee to the selected subtraining
     db.subtraining_add_attendee(tg_user, training_date, coach)
+    util.poke_scheduler(context)
 
     msg = "Glückwunsch, du nimmst am *{}* an *{}* mit *{}* teil \U0001F4AA\U0001F4AA\U0001F4AA \n\n" \
           "Wir freuen uns auf dich!".format(date.strftime(c.DATE_FORMAT), sub_training["title"].replace("\n", " "),
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+"""
+Benchmark the data layer with synthetic trainings
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import constants as c
+import continuous_task
+from Fanout import FanoutReport
+from MemoryStorage import MemoryStorage
+from User import User
+import util
+
+OPERATIONS = ["get_my_trainings_coach", "get_my_trainings_attendee", "get_subtrainings", "training_list", "next_trainings",
+              "next_trainings_cached", "subtraining_add_attendee", "cancel_subtrainings", "notification_pass"]
+
+
+class FakeNotifier:
+    """Notifier delivering every message instantly without telegram"""
+
+    def notify(self, message: str, chat_id):
+        pass
+
+    def notify_many(self, messages: list) -> FanoutReport:
+        return FanoutReport([True] * len(messages), [0.0] * len(messages), 0.0, 0)
+
+
+def get_user_dict(chat_id: int, role: int) -> dict:
+    return {"chat_id": chat_id,
+            "user_name": "user{}".format(chat_id),
+            "full_name": "User {}".format(chat_id),
+            "notified_far": False,
+            "notified_now": False,
+            "role": role}
+
+
+def generate(db, num_trainings: int, num_subtrainings: int, num_attendees: int, num_users: int,
+             num_future=4, seed=0) -> list:
+    """Fill the storage with weekly trainings, the last num_future of them lie in the future.
+    Users are drawn from a pool of num_users chat ids, a few users attend
+    most of the trainings like in the real world
+
+    :param db: Storage to fill, all its trainings are deleted first
+    :param num_trainings: Number of training dates
+    :param num_subtrainings: Subtrainings per training
+    :param num_attendees: Attendees per subtraining
+    :param num_users: Size of the chat id pool
+    :param num_future: Number of trainings in the future
+    :param seed: Seed of the random generator
+    :return: list of the unix timestamps of the trainings
+    """
+    rand = random.Random(seed)
+    users = list(range(1, num_users + 1))
+    weights = [1 / i for i in users]
+    first = datetime.datetime.now().replace(second=0, microsecond=0) + \
+        datetime.timedelta(days=7 * (num_future - num_trainings), hours=1)
+    db.delete_all_trainings()
+    dates = []
+    for i in range(num_trainings):
+        date = int((first + datetime.timedelta(days=7 * i)).timestamp())
+        coaches = rand.sample(users, min(num_subtrainings, num_users))
+        subtrainings = []
+        taken = set(coaches)
+        for coach in coaches:
+            attendees = set()
+            while len(attendees) < num_attendees and len(taken) < num_users:
+                chat_id = rand.choices(users, weights)[0]
+                if chat_id not in taken:
+                    attendees.add(chat_id)
+                    taken.add(chat_id)
+            subtrainings.append({"date": date,
+                                 "coach": get_user_dict(coach, c.COACH),
+                                 "title": "Training {}".format(coach),
+                                 "description": "",
+                                 "attendees": [get_user_dict(a, c.ATTENDEE) for a in attendees],
+                                 "time": "18:00",
+                                 "link": c.MEETING_BASE_URL + str(date)})
+        db._insert_training({"date": date, "time": "18:00", "attendees": [], "subtrainings": subtrainings,
+                             "link": c.MEETING_BASE_URL + str(date)})
+        dates.append(date)
+    db.cache.invalidate()
+    db.rebuild_notification_ledger()
+    return dates
+
+
+def get_user(chat_id: int, role=c.ATTENDEE) -> User:
+    return User(from_dict=get_user_dict(chat_id, role))
+
+
+def measure(function, repeats: int) -> list:
+    """Call function(i) repeats times and return the durations in ms"""
+    durations = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(i)
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def measure_allocations(function) -> tuple:
+    """Call function(0) once and return the memory blocks still held by its
+    result and the peak of the traced memory in KiB"""
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    result = function(0)
+    blocks = sys.getallocatedblocks() - blocks
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    del result
+    return blocks, peak
+
+
+def run_size(db, num_trainings: int, args) -> list:
+    """Generate one dataset and time every operation on it"""
+    dates = generate(db, num_trainings, args.subtrainings, args.attendees, args.users, seed=args.seed)
+    future = [d for d in dates if d > time.time()]
+    rand = random.Random(args.seed)
+    chat_ids = [rand.randint(1, args.users) for _ in range(args.repeats)]
+
+    def add_attendee(i):
+        sub = db.next_trainings(number_of_trainings=1)[0]["subtrainings"][0]
+        db.subtraining_add_attendee(get_user(args.users + i + 1), future[0], get_user(sub["coach"]["chat_id"]))
+
+    def notification_pass(i):
+        continuous_task.notify_due_trainings(db, FakeNotifier())
+
+    def uncached_next_trainings(i):
+        db.cache.invalidate()
+        db.next_trainings(number_of_trainings=c.FUTURE_TRAININGS)
+
+    operations = {
+        "get_my_trainings_coach": lambda i: db.get_my_trainings(get_user(chat_ids[i]), c.COACH),
+        "get_my_trainings_attendee": lambda i: db.get_my_trainings(get_user(chat_ids[i]), c.ATTENDEE),
+        "get_subtrainings": lambda i: db.get_subtrainings(get_user(chat_ids[i])),
+        "training_list": lambda i: util.get_training_list(db.get_my_trainings(get_user(chat_ids[i]), c.ATTENDEE)),
+        "next_trainings": uncached_next_trainings,
+        "next_trainings_cached": lambda i: db.next_trainings(number_of_trainings=c.FUTURE_TRAININGS),
+        "subtraining_add_attendee": add_attendee,
+        "cancel_subtrainings": lambda i: db.cancel_subtrainings(future[0], get_user(args.users + i + 1)),
+        # reminders are sent in the first pass, later passes only measure the due lookup
+        "notification_pass": notification_pass,
+    }
+    results = []
+    for name in OPERATIONS:
+        durations = measure(operations[name], args.repeats)
+        blocks, peak = measure_allocations(operations[name])
+        results.append({"operation": name,
+                        "trainings": num_trainings,
+                        "subtrainings": args.subtrainings,
+                        "attendees": args.attendees,
+                        "users": args.users,
+                        "repeats": args.repeats,
+                        "first_ms": durations[0],
+                        "median_ms": statistics.median(durations),
+                        "mean_ms": statistics.mean(durations),
+                        "max_ms": max(durations),
+                        "result_blocks": blocks,
+                        "peak_kib": peak})
+    return results
+
+
+def open_backend(args):
+    if args.backend == "memory":
+        return MemoryStorage(name="benchmark_trainings")
+    if args.backend == "sqlite":
+        from SqliteStorage import SqliteStorage
+        return SqliteStorage(args.config, path=args.sqlite_file)
+    # the mongo backend uses the debug trainings of the configured database
+    from Database import Database
+    return Database(args.config, debug_mode=True)
+
+
+def compare(results: list, baseline_file: str):
+    """Print the change of the median against a previous result file"""
+    with open(baseline_file) as f:
+        baseline = {(r["operation"], r["trainings"]): r for r in json.load(f)["results"]}
+    print("\nChange against {}:".format(baseline_file))
+    for r in results:
+        old = baseline.get((r["operation"], r["trainings"]))
+        if old is not None and old["median_ms"] > 0:
+            print("{:28} {:>7} {:>+8.1f}%".format(r["operation"], r["trainings"],
+                                                  (r["median_ms"] / old["median_ms"] - 1) * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", choices=["memory", "sqlite", "mongo"], default="memory",
+                        help="mongo drops the debug trainings of the configured database")
+    parser.add_argument("--config", default=c.CONFIG_FILE)
+    parser.add_argument("--sqlite-file", default="benchmark.sqlite")
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated numbers of trainings")
+    parser.add_argument("--subtrainings", type=int, default=5)
+    parser.add_argument("--attendees", type=int, default=8)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    args = parser.parse_args(argv)
+
+    db = open_backend(args)
+    results = []
+    print("{:28} {:>7} {:>10} {:>10} {:>10} {:>8} {:>10}".format("operation", "trainings", "first ms", "median ms",
+                                                               "max ms", "blocks", "peak KiB"))
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for r in run_size(db, size, args):
+            print("{:28} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>8} {:>10.1f}".format(
+                r["operation"], r["trainings"], r["first_ms"], r["median_ms"], r["max_ms"],
+                r["result_blocks"], r["peak_kib"]))
+            results.append(r)
+    db.delete_all_trainings()
+
+    with open(args.output, "w") as f:
+        json.dump({"backend": args.backend,
+                   "python": platform.python_version(),
+                   "date": datetime.datetime.now().isoformat(),
+                   "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
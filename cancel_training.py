@@ -6,7 +6,6 @@ from telegram.ext import CallbackContext
 import constants as c
 import util
 from User import User
-from Notifier import Notifier
 
 logging.basicConfig(
     format=c.LOG_FORMAT, level=logging.INFO, filename="coachbot.log"
@@ -167,10 +166,8 @@ def cancel_training_coach(update: Update, context: CallbackContext) -> int:
     db.remove_training_of_coach(user, int(cancelled_training.get_date("%s")))
     date = cancelled_training.get_date(c.DATE_FORMAT)
     msg = "Du hast das Training am {} abgesagt".format(date)
-    notifier = Notifier()
-    for attendee in cancelled_training.get_attendees():
-        notifier.notify("Das Training am *{}* wurde leider *abgesagt* \U0001F625".format(date),
-                        attendee.get_chat_id())
+    message = "Das Training am *{}* wurde leider *abgesagt* \U0001F625".format(date)
+    util.send_later(context, [(attendee.get_chat_id(), message) for attendee in cancelled_training.get_attendees()])
 
     update.message.reply_text(
         msg,
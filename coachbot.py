@@ -1,10 +1,13 @@
-import json
+import datetime
 import locale
 import logging
 import os
+from queue import Queue
+import secrets
 
-from telegram import ReplyKeyboardRemove, Update
+from telegram import Bot, ReplyKeyboardRemove, Update
 from telegram.ext import (
+    JobQueue,
     Updater,
     CommandHandler,
     MessageHandler,
@@ -12,13 +15,21 @@ from telegram.ext import (
     ConversationHandler,
     CallbackContext,
 )
+from telegram.utils.request import Request
 
 import attend_training
 import cancel_training
 import constants as c
+from continuous_task import NotificationScheduler
+from Notifier import get_notifier
+from Outbox import OutboxSender
+from ChatDispatcher import ChatDispatcher
+from Config import Config, get_config
 import info
 import util
-from Database import Database
+from Database import pool_stats
+from SqlitePersistence import SqlitePersistence
+from Storage import open_storage
 from Training import Training
 
 locale.setlocale(locale.LC_TIME, 'de_DE.UTF-8')
@@ -37,13 +48,13 @@ def start(update: Update, context: CallbackContext) -> int:
     """
     # Init data
     # Enable logging
-    db = Database(c.CONFIG_FILE, debug_mode=c.DEBUG_MODE)
-    
+    db = open_storage(c.CONFIG_FILE, debug_mode=c.DEBUG_MODE)
+    logger.debug("Database pool: %s, trainings cache: %s", pool_stats(), db.cache_stats())
+
     channel_id = util.get_channel_id()
     training = Training()
 
-    # Store data in user context
-    context.user_data["db"] = db
+    # Store data in user context, everything in it must be serialisable by the persistence
     context.user_data["training"] = training
     context.user_data["channel_id"] = channel_id
 
@@ -90,6 +101,54 @@ def select_action(update: Update, context: CallbackContext) -> int:
         return c.START
 
 
+def archive_trainings(context: CallbackContext):
+    """Job moving the trainings older than the retention time into the archive"""
+    db, max_age = context.job.context
+    archived = db.archive_trainings(max_age)
+    if archived > 0:
+        logger.info("Archived {} trainings older than {}".format(archived, max_age))
+
+
+def create_updater(bot_token: str, config: Config, persistence: SqlitePersistence) -> Updater:
+    """
+    Create the updater, in the concurrent mode with a dispatcher processing different chats in parallel.
+    :param bot_token: Token of the bot
+    :param config: Config object
+    :param persistence: Persistence of the conversations
+    :return: Updater object
+    """
+    workers = config.get("workers", c.UPDATER_WORKERS)
+    if not config.get("concurrent-updates", False):
+        return Updater(token=bot_token, workers=workers, persistence=persistence, use_context=True)
+    # one connection per chat worker plus the ones of the dispatcher and the updater
+    bot = Bot(token=bot_token, request=Request(con_pool_size=workers + c.UPDATER_WORKERS + 2))
+    job_queue = JobQueue()
+    dispatcher = ChatDispatcher(bot, Queue(), job_queue=job_queue, persistence=persistence, chat_workers=workers)
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None, use_context=True)
+
+
+def start_webhook(updater: Updater, webhook: dict):
+    """
+    Receive the updates over a local http listener instead of long polling.
+    TLS is terminated by a reverse proxy that forwards the public url to the listener.
+    :param updater: Updater of the bot
+    :param webhook: webhook section of the config file
+    """
+    # without a configured secret path a new one is used on every start
+    secret_path = webhook.get("secret-path") or secrets.token_urlsafe(c.WEBHOOK_SECRET_BYTES)
+    updater.start_webhook(listen=webhook.get("listen", c.WEBHOOK_LISTEN),
+                          port=webhook.get("port", c.WEBHOOK_PORT),
+                          url_path=secret_path)
+    # the updater only registers the webhook itself when it terminates TLS
+    url = webhook.get("url")
+    if url is not None:
+        updater.bot.set_webhook(url="{}/{}".format(url.rstrip("/"), secret_path))
+        logger.info("Receiving updates via webhook %s", url)
+    else:
+        logger.info("Webhook not registered at telegram, only local updates are received")
+
+
 def main(config_file: str) -> bool:
     """
     Main function of the training telegram bot
@@ -102,12 +161,14 @@ def main(config_file: str) -> bool:
         return False
 
     # read token from config file
-    with open(config_file) as f:
-        conf = json.load(f)
-    bot_token = conf[c.BOT_TOKEN]
+    config = get_config(config_file)
+    bot_token = config.get_bot_token()
+
+    # Conversations survive restarts of the bot
+    persistence = SqlitePersistence(config.get("persistence-file", c.PERSISTENCE_FILE))
 
     # Create the Updater and pass it your bot's token.
-    updater = Updater(token=bot_token, use_context=True)
+    updater = create_updater(bot_token, config, persistence)
 
     # Get the dispatcher to register handlers
     dispatcher = updater.dispatcher
@@ -139,16 +200,46 @@ def main(config_file: str) -> bool:
                                                      cancel_training.cancel_training_coach)],
         },
         fallbacks=[MessageHandler(Filters.command, cancel)],
+        name="coachbot",
+        persistent=True,
     )
 
     dispatcher.add_handler(conv_handler)
 
+    # Write the changed conversations in batches
+    updater.job_queue.run_repeating(lambda context: persistence.flush(), interval=c.PERSISTENCE_FLUSH_SECONDS,
+                                    name="persistence")
+
+    # Deliver the messages the handlers put into the outbox
+    outbox = OutboxSender(updater.job_queue, open_storage(config_file, debug_mode=c.DEBUG_MODE), get_notifier())
+    dispatcher.bot_data["outbox"] = outbox
+    outbox.start()
+
+    # Keep only the recent trainings in the hot collections
+    retention_days = config.get("retention-days", c.RETENTION_DAYS)
+    if retention_days is not None:
+        updater.job_queue.run_repeating(archive_trainings, interval=c.RETENTION_INTERVAL_SECONDS, first=60,
+                                        context=(open_storage(config_file, debug_mode=c.DEBUG_MODE),
+                                                 datetime.timedelta(days=retention_days)),
+                                        name="retention")
+
+    # Send the reminders from this process instead of the cron script
+    if config.get("notifications-in-process", False):
+        scheduler = NotificationScheduler(updater.job_queue, open_storage(config_file, debug_mode=c.DEBUG_MODE),
+                                          get_notifier())
+        dispatcher.bot_data["scheduler"] = scheduler
+        scheduler.start()
+
     # Start the Bot
-    updater.start_polling()
+    webhook = config.get("webhook")
+    if webhook is not None:
+        start_webhook(updater, webhook)
+    else:
+        updater.start_polling()
 
     # Run the bot until you press Ctrl-C or the process receives SIGINT,
     # SIGTERM or SIGABRT. This should be used most of the time, since
-    # start_polling() is non-blocking and will stop the bot gracefully.
+    # start_polling() and start_webhook() are non-blocking and will stop the bot gracefully.
     updater.idle()
 
 
@@ -32,6 +32,23 @@ CMD_ATTENDEE = "teilnehmer"
 CMD_COACH = "trainer"
 
 CONFIG_FILE = "config.json"
+
+STORAGE_BACKEND = "mongo"
+SQLITE_FILE = "trainings.sqlite"
+SUBTRAINING_SCHEMA = "embedded"
+MIGRATION_BATCH_SIZE = 100
+# trainings older than this many days are moved into the archive, None keeps them
+RETENTION_DAYS = 180
+RETENTION_INTERVAL_SECONDS = 24 * 60 * 60
+ARCHIVE_BATCH_SIZE = 100
+EXPORT_BATCH_SIZE = 500
+
+DB_MAX_POOL_SIZE = 20
+DB_MIN_POOL_SIZE = 0
+DB_CONNECT_TIMEOUT_MS = 5000
+DB_SERVER_SELECTION_TIMEOUT_MS = 10000
+DB_SOCKET_TIMEOUT_MS = 20000
+TRAINING_CACHE_TTL_SECONDS = 30
 FUTURE_TRAININGS = 3
 MIN_CHARS_TITLE = 5
 
@@ -51,6 +68,33 @@ LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 LOG_FILE = "coachbot.log"
 
 NOTIFICATION_FREQUENCY_SECONDS = 60
+# the scheduler wakes up at least this often to see trainings added by other processes
+NOTIFICATION_MAX_SLEEP = datetime.timedelta(hours=1)
+
+TELEGRAM_POOL_SIZE = 8
+PERSISTENCE_FILE = "conversations.sqlite"
+PERSISTENCE_FLUSH_SECONDS = 5
+
+FRAGMENT_CACHE_SIZE = 1000
+
+UPDATER_WORKERS = 4
+CHAT_WORKERS = 8
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+# random bytes of a generated webhook path
+WEBHOOK_SECRET_BYTES = 32
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_SECONDS = 30
+OUTBOX_LEASE_SECONDS = 120
+OUTBOX_RETRY_SECONDS = 30
+OUTBOX_MAX_ATTEMPTS = 5
+
+FANOUT_WORKERS = 8
+FANOUT_MAX_RETRIES = 3
+# telegram allows about 30 messages per second overall and one per second to a chat
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
 NEXT_TRAINING_NOTIFY_FAR = datetime.timedelta(days=1)
 NEXT_TRAINING_NOTIFY_NOW = datetime.timedelta(minutes=30)
 
@@ -1,9 +1,15 @@
-from Database import Database
-from Notifier import Notifier
 import datetime
+import logging
+import threading
+
+from Storage import Storage, open_storage
+from Notifier import Notifier, get_notifier
 import constants as c
-from User import User
-from Training import Training
+
+logging.basicConfig(
+    format=c.LOG_FORMAT, level=logging.INFO, filename="coachbot.log"
+)
+logger = logging.getLogger(__name__)
 
 
 def get_message_next_day(training: dict, subtraining: dict, day_str: str) -> str:
@@ -47,93 +53,168 @@ def get_message(training: dict, subtraining: dict) -> str:
     return message
 
 
-def notify_user(db: Database, sub_tr: Training, notifier: Notifier, user: User, time_to_training: datetime.timedelta, message: str):
-    """
-    Notify a user with the given message
-
-    :param db: Database object
-    :param sub_tr: Subtraining object
-    :param notifier: Notifier object
-    :param user: User object
-    :param time_to_training: Time till the next training starts
-    :param message: Notification message
-    :return:
+def get_day_str(date: datetime.datetime) -> str:
+    """Describe in how many days the training at date takes place
+
+    :param date: date of the training
+    :type date: datetime.datetime
+    :return: e.g. heute, morgen or in 3 Tagen
+    :rtype: str
     """
-    is_now = time_to_training <= c.NEXT_TRAINING_NOTIFY_NOW
-    is_far = time_to_training < c.NEXT_TRAINING_NOTIFY_FAR
-    if is_now is True:
-        if user.is_notified_now():
-            return
-        db.set_notify_now_flag(True, sub_tr, user)
-    elif is_far is True:
-        if user.is_notified_far():
-            return
-        db.set_notify_far_flag(True, sub_tr, user)
-
-    notifier.notify(message=message, chat_id=user.get_chat_id())
-
-
-def notify_all_attendees(db: Database, training: dict, notifier: Notifier, time_to_training: datetime.timedelta):
-    """notify all attendees about their trainings now.
-
-    :param db: Database object
-    :type db: Database
-    :param training: training data
-    :type training: dict
+    if datetime.datetime.today().day == date.day:
+        return "heute"
+    elif (datetime.datetime.today() + datetime.timedelta(days=1)).day == date.day:
+        return "morgen"
+    elif (datetime.datetime.today() + datetime.timedelta(days=1)).day == date.day:
+        return "übermorgen"
+    time_diff = (date - datetime.datetime.today())
+    num_days = time_diff.days
+    if time_diff.seconds > 0:
+        num_days += 1
+    if num_days == 1:
+        return "morgen"
+    elif num_days == 2:
+        return "übermorgen"
+    return "in " + str(num_days) + " Tagen"
+
+
+def notify_due_trainings(db: Storage, notifier: Notifier):
+    """Send all due and unsent reminders of the notification ledger.
+    The due reminders are claimed in one write before they are sent and
+    the undelivered ones are released in one write, so every reminder
+    is delivered exactly once
+
+    :param db: Storage object
+    :type db: Storage
     :param notifier: notifier instance
     :type notifier: Notifier
-    :param time_to_training: Timedelta till next training
-    :type time_to_training: datetime.timedelta
+    :return: report of the sent messages or None if nothing was due
+    :rtype: FanoutReport
     """
-
-    is_now = time_to_training <= c.NEXT_TRAINING_NOTIFY_NOW
-    is_far = time_to_training < c.NEXT_TRAINING_NOTIFY_FAR
-
-    for sub in training["subtrainings"]:
-        sub_tr = Training(from_dict=sub)
-        if is_now:
-            message = get_message(training=training, subtraining=sub)
-        elif is_far:
-            if datetime.datetime.today().day == sub_tr.date.day:
-                day_str = "heute"
-            elif (datetime.datetime.today() + datetime.timedelta(days=1)).day == sub_tr.date.day:
-                day_str = "morgen"
-            elif (datetime.datetime.today() + datetime.timedelta(days=1)).day == sub_tr.date.day:
-                day_str = "übermorgen"
-            else:
-                time_diff = (sub_tr.date - datetime.datetime.today())
-                num_days = time_diff.days
-                if time_diff.seconds > 0:
-                    num_days += 1
-                if num_days == 1:
-                    day_str = "morgen"
-                elif num_days == 2:
-                    day_str = "übermorgen"
-                else:
-                    day_str = "in " + str(num_days) + " Tagen"
-            message = get_message_next_day(training=training, subtraining=sub, day_str=day_str)
+    now = datetime.datetime.now()
+    rows = db.claim_due_notifications(now.timestamp())
+    if len(rows) == 0:
+        return None
+    # only read the trainings up to the last one with a due reminder
+    last_date = max(row["date"] for row in rows)
+    trainings = {}
+    for training in db.iter_next_trainings():
+        date = int(training["date"].timestamp())
+        if date > last_date:
+            break
+        trainings[date] = training
+
+    # a due reminder right before the training replaces the one of the day before
+    now_due = set((row["chat_id"], row["date"], row["role"]) for row in rows if row["kind"] == "now")
+    messages = []
+    sent = []
+    unsent = []
+    for row in rows:
+        if row["kind"] == "far" and (row["chat_id"], row["date"], row["role"]) in now_due:
+            continue
+        training = trainings.get(row["date"], {"subtrainings": []})
+        subtrainings = [sub for sub in training["subtrainings"] if sub["coach"]["chat_id"] == row["coach_chat_id"]]
+        if len(subtrainings) == 0:
+            unsent.append(row)
+            continue
+        if row["kind"] == "now":
+            message = get_message(training=training, subtraining=subtrainings[0])
         else:
-            return
-        for att in sub["attendees"]:
-            attendee = User(from_dict=att)
-            notify_user(db, sub_tr, notifier, attendee, time_to_training, message)
-        coach = sub_tr.get_coach()
-        notify_user(db, sub_tr, notifier, coach, time_to_training, message)
-    return
+            message = get_message_next_day(training=training, subtraining=subtrainings[0],
+                                           day_str=get_day_str(training["date"]))
+        messages.append((row["chat_id"], message))
+        sent.append(row)
+
+    report = notifier.notify_many(messages)
+    unsent.extend(row for delivered, row in zip(report.delivered, sent) if not delivered)
+    db.release_notifications(unsent)
+    return report
+
+
+def get_next_due_time(db: Storage, now: datetime.datetime):
+    """Get the next time after now when a reminder becomes due
+
+    :param db: Storage object
+    :type db: Storage
+    :param now: current time
+    :type now: datetime.datetime
+    :return: due time or None if no reminder is pending
+    :rtype: datetime.datetime
+    """
+    next_due = db.next_notification_due(now.timestamp())
+    if next_due is None:
+        return None
+    return datetime.datetime.fromtimestamp(next_due)
+
+
+class NotificationScheduler:
+    """Send the reminders from inside the bot process. The scheduler
+    sleeps until the next reminder is due and keeps the storage and
+    notifier connections warm"""
+
+    def __init__(self, job_queue, db: Storage, notifier: Notifier):
+        """
+        :param job_queue: JobQueue of the bot
+        :param db: Storage object
+        :param notifier: Notifier object
+        """
+        self.job_queue = job_queue
+        self.db = db
+        self.notifier = notifier
+        self.job = None
+        self.next_run = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Send the reminders due now and schedule the next run"""
+        self.schedule(datetime.timedelta(seconds=0))
+
+    def poke(self):
+        """Reschedule after trainings or attendees changed. Several
+        pokes within NOTIFICATION_FREQUENCY_SECONDS cause a single run"""
+        self.schedule(datetime.timedelta(seconds=c.NOTIFICATION_FREQUENCY_SECONDS))
+
+    def schedule(self, delay: datetime.timedelta):
+        """Run the scheduler after delay unless an earlier run is already scheduled"""
+        when = datetime.datetime.now() + delay
+        with self.lock:
+            if self.job is not None:
+                if self.next_run <= when:
+                    return
+                self.job.schedule_removal()
+            self.next_run = when
+            self.job = self.job_queue.run_once(self.run, when=delay.total_seconds(), name="notifications")
+
+    def run(self, context=None):
+        """Job callback: send all due reminders and sleep until the next one"""
+        # a poke from now on schedules a new run, changes from before are read by this one
+        with self.lock:
+            self.job = None
+            self.next_run = None
+        delay = c.NOTIFICATION_MAX_SLEEP
+        try:
+            report = notify_due_trainings(self.db, self.notifier)
+            if report is not None and report.get_failed() > 0:
+                # retry the failed reminders soon
+                delay = datetime.timedelta(seconds=c.NOTIFICATION_FREQUENCY_SECONDS)
+        except Exception as e:
+            logger.error("Notification run failed: %s", e)
+            delay = datetime.timedelta(seconds=c.NOTIFICATION_FREQUENCY_SECONDS)
+        now = datetime.datetime.now()
+        next_due = get_next_due_time(self.db, now)
+        if next_due is not None and next_due - now < delay:
+            delay = next_due - now
+        logger.info("Next notification run at %s", now + delay)
+        # keeps an earlier run scheduled by a poke during this run
+        self.schedule(delay)
 
 
 def main():
-    notifier = Notifier()
-    db = Database(c.CONFIG_FILE, debug_mode=c.DEBUG_MODE)
-    next_training = db.next_trainings(number_of_trainings=1)[0]
-    now = datetime.datetime.now()
-    training_start_time = next_training["date"]
-    if now > training_start_time:
-        return
-    time_to_training = training_start_time - now
-    notify_all_attendees(db=db, training=next_training, notifier=notifier, time_to_training=time_to_training)
-    
+    notifier = get_notifier()
+    db = open_storage(c.CONFIG_FILE, debug_mode=c.DEBUG_MODE)
+    notify_due_trainings(db, notifier)
+
 
 if __name__ == "__main__":
-    """ run this file every hour"""
+    """ run this file every half hour, or let the bot run the NotificationScheduler"""
     main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+"""
+Post fake telegram updates to the local webhook listener of the bot
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import constants as c
+
+
+def get_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Create a telegram update of a private text message
+
+    :param update_id: Id of the update
+    :param chat_id: Chat and user id of the sender
+    :param text: Text of the message
+    :return: update as sent by telegram
+    :rtype: dict
+    """
+    user = {"id": chat_id, "is_bot": False, "first_name": "User", "last_name": str(chat_id),
+            "username": "user{}".format(chat_id)}
+    message = {"message_id": update_id,
+               "from": user,
+               "chat": {"id": chat_id, "type": "private", "first_name": "User", "last_name": str(chat_id)},
+               "date": int(time.time()),
+               "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def post(url: str, update: dict) -> float:
+    """Post an update to the webhook
+
+    :return: duration of the request in ms
+    :rtype: float
+    """
+    request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("secret_path", help="secret-path of the webhook section in the config file")
+    parser.add_argument("--listen", default=c.WEBHOOK_LISTEN)
+    parser.add_argument("--port", type=int, default=c.WEBHOOK_PORT)
+    parser.add_argument("--text", default="/" + c.CMD_START, help="text of every message")
+    parser.add_argument("--chats", type=int, default=10, help="number of different chats")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4, help="number of parallel requests")
+    parser.add_argument("--first-chat-id", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    url = "http://{}:{}/{}".format(args.listen, args.port, args.secret_path)
+    updates = [get_update(i + 1, args.first_chat_id + i % args.chats, args.text) for i in range(args.updates)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        durations = list(executor.map(lambda update: post(url, update), updates))
+    duration = time.perf_counter() - start
+    print("Posted {} updates in {:.2f}s ({:.1f}/s), median {:.1f} ms, max {:.1f} ms".format(
+        len(durations), duration, len(durations) / duration, statistics.median(durations), max(durations)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
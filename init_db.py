@@ -1,15 +1,44 @@
 #!/usr/bin/python
 """
-Initialize the mongodb database with training dates
+Maintain the trainings of the database: create the training dates,
+purge trainings and export or import them as JSON lines
 """
-import sys
+import argparse
+import datetime
+import gzip
 import json
+import sys
 
+from Config import get_config
 from Database import Database
+from Storage import open_storage
+from SplitDatabase import SplitDatabase
 import constants as c
 
 
-def main():
+def open_file(path: str, mode: str):
+    """Open a JSON lines file, gzip compressed if the name ends with .gz
+    and stdin or stdout for -
+
+    :param mode: r or w
+    :type mode: str
+    """
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def get_day(day: str) -> datetime.datetime:
+    """Parse a YYYY-MM-DD argument"""
+    try:
+        return datetime.datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} is no date of the format YYYY-MM-DD".format(day))
+
+
+def create(database, args) -> int:
     """
     Initialize the mongodb database with possible training dates.
     The configuration file config.json needs the following structure:
@@ -27,19 +56,136 @@ def main():
     The weekday is provided as int (where 0 means monday and 6 is sunday).
     In the trainings list you can provide dates and times of the week, where
     trainings are possible.
-    The next num_trainings trainings are then initialized in the database
+    The next num_trainings trainings are then initialized in the database,
+    existing trainings are kept. With --extend only the dates after the
+    last existing training are written
     """
-    database = Database(c.CONFIG_FILE, False)
+    config = get_config(args.config)
+    if config.get("num_trainings") is None:
+        print(f"ERROR: Key \"num_trainings\" missing in config file {args.config}")
+        return 1
+
+    created = database.create_trainings(config.get_num_trainings(), extend=args.extend)
+    print(f"Created {created} trainings")
+    database.rebuild_notification_ledger()
+
+    if isinstance(database, Database):
+        for collection, report in database.index_report().items():
+            for key, indexes in report.items():
+                if len(indexes) > 0:
+                    print(f"{collection}: {key} indexes: {', '.join(indexes)}")
+    return 0
+
+
+def rebuild_user_trainings(database, args) -> int:
+    """Fill the user_trainings reverse index of the mongo backend once after upgrading"""
+    if not isinstance(database, Database) or (isinstance(database, SplitDatabase) and not database.dual):
+        print("ERROR: only the embedded mongo schema has a user_trainings index")
+        return 1
+    upserted, deleted = database.rebuild_user_trainings()
+    print(f"Upserted {upserted} and deleted {deleted} user_trainings rows")
+    return 0
+
+
+def purge_future(database, args) -> int:
+    """Delete all trainings in the future"""
+    database.delete_future_trainings()
+    print("Deleted the future trainings")
+    return 0
+
+
+def purge_range(database, args) -> int:
+    """Delete the trainings from the first to the last day"""
+    if args.last < args.first:
+        print("ERROR: the last day is before the first day")
+        return 1
+    # the dates are whole seconds, so after the second before midnight includes the first day
+    database.delete_trainings(after=args.first.timestamp() - 1,
+                              before=(args.last + datetime.timedelta(days=1)).timestamp())
+    print(f"Deleted the trainings from {args.first:%Y-%m-%d} to {args.last:%Y-%m-%d}")
+    return 0
+
+
+def export(database, args) -> int:
+    """Write the trainings as one JSON object per line"""
+    exported = 0
+    f = open_file(args.file, "w")
+    try:
+        for training in database.iter_trainings(archived=args.archived, batch_size=args.batch_size):
+            f.write(json.dumps(training, ensure_ascii=False) + "\n")
+            exported += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    print(f"Exported {exported} trainings", file=sys.stderr)
+    return 0
+
+
+def import_(database, args) -> int:
+    """Read trainings written by export, the existing dates are skipped"""
+    imported = 0
+    read = 0
+    batch = []
+    f = open_file(args.file, "r")
+    try:
+        for line in f:
+            if line.strip() == "":
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= args.batch_size:
+                imported += database.import_trainings(batch)
+                read += len(batch)
+                batch = []
+        imported += database.import_trainings(batch)
+        read += len(batch)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    database.rebuild_notification_ledger()
+    print(f"Imported {imported} of {read} trainings")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, epilog="""
+    Without a command the trainings are created like with the create command.""")
+    parser.add_argument("--config", default=c.CONFIG_FILE)
+    parser.add_argument("--debug", action="store_true", help="work on the debug trainings")
+    commands = parser.add_subparsers(dest="command")
+
+    command = commands.add_parser("create", help="create the next num_trainings training dates")
+    command.add_argument("--extend", action="store_true", help="only add the dates after the last training")
+    command.set_defaults(run=create)
+
+    command = commands.add_parser("rebuild-user-trainings", help="fill the user_trainings index of mongodb once")
+    command.set_defaults(run=rebuild_user_trainings)
+
+    command = commands.add_parser("purge-future", help="delete all trainings in the future")
+    command.set_defaults(run=purge_future)
+
+    command = commands.add_parser("purge-range", help="delete the trainings from the first to the last day")
+    command.add_argument("first", type=get_day, help="first day as YYYY-MM-DD")
+    command.add_argument("last", type=get_day, help="last day as YYYY-MM-DD")
+    command.set_defaults(run=purge_range)
+
+    command = commands.add_parser("export", help="write the trainings to a JSON lines file")
+    command.add_argument("file", help="output file, - for stdout, compressed if it ends with .gz")
+    command.add_argument("--archived", action="store_true", help="export the archived trainings")
+    command.add_argument("--batch-size", type=int, default=c.EXPORT_BATCH_SIZE)
+    command.set_defaults(run=export)
 
-    with open(c.CONFIG_FILE, "r") as cfg:
-        config = json.load(cfg)
+    command = commands.add_parser("import", help="add the trainings of a JSON lines file")
+    command.add_argument("file", help="input file, - for stdin, compressed if it ends with .gz")
+    command.add_argument("--batch-size", type=int, default=c.EXPORT_BATCH_SIZE)
+    command.set_defaults(run=import_)
 
-    if "num_trainings" not in config:
-        print(f"ERROR: Key \"num_trainings\" missing in config file {c.CONFIG_FILE}")
-        sys.exit(1)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(list(argv if argv is not None else sys.argv[1:]) + ["create"])
 
-    database.create_trainings(config["num_trainings"])
+    database = open_storage(args.config, args.debug)
+    return args.run(database, args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+"""
+Copy the subtrainings embedded in the training documents to the subtrainings collection
+"""
+import argparse
+import sys
+
+import pymongo
+
+import constants as c
+from Config import get_config
+from SplitDatabase import SplitDatabase, get_copy_request
+
+
+def get_checkpoint_id(db: SplitDatabase) -> str:
+    return "subtrainings:" + db.trainings.name
+
+
+def read_batch(db: SplitDatabase, after, batch_size: int) -> list:
+    """Read the dates and subtrainings of the next batch_size trainings after the date after"""
+    query = {} if after is None else {"date": {"$gt": after}}
+    return list(db.trainings.find(query, {"_id": 0, "date": 1, "subtrainings": 1})
+                .sort("date", pymongo.ASCENDING).limit(batch_size))
+
+
+def migrate_batch(db: SplitDatabase, after, batch_size: int):
+    """Copy the subtrainings of the next batch_size trainings after the date after.
+    Only missing subtrainings are inserted: the bot in the dual mode keeps writing
+    while the batch is copied, so its copies are newer than the ones read here
+
+    :param db: SplitDatabase object
+    :param after: date of the last migrated training, None to start at the beginning
+    :param batch_size: number of trainings
+    :return: date of the last training of the batch, None if there was none, and the number of trainings
+    """
+    trainings = read_batch(db, after, batch_size)
+    if len(trainings) == 0:
+        return None, 0
+    requests = [get_copy_request(sub) for training in trainings for sub in training.get("subtrainings", [])]
+    if len(requests) > 0:
+        db.subtrainings.bulk_write(requests, ordered=False)
+    return trainings[-1]["date"], len(trainings)
+
+
+def reconcile_training(db: SplitDatabase, date: int) -> int:
+    """Read the training at date again and make the copies of its
+    subtrainings equal to the embedded subtrainings
+
+    :return: number of repaired subtrainings
+    """
+    training = db.trainings.find_one({"date": date}, {"_id": 0, "subtrainings": 1})
+    embedded = {} if training is None else {sub["coach"]["chat_id"]: sub for sub in training.get("subtrainings", [])}
+    copies = {sub["coach"]["chat_id"]: sub for sub in db.subtrainings.find({"date": date}, {"_id": 0})}
+    requests = [pymongo.ReplaceOne({"date": date, "coach.chat_id": coach_chat_id}, sub, upsert=True)
+                for coach_chat_id, sub in embedded.items() if copies.get(coach_chat_id) != sub]
+    requests += [pymongo.DeleteOne({"date": date, "coach.chat_id": coach_chat_id})
+                 for coach_chat_id in copies if coach_chat_id not in embedded]
+    if len(requests) > 0:
+        db.subtrainings.bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+def verify_batch(db: SplitDatabase, after, batch_size: int):
+    """Compare the copies of the next batch_size trainings after the date after
+    with the embedded subtrainings and reconcile the trainings that differ, e.g. a
+    subtraining copied from an old read after the bot removed it
+
+    :return: date of the last training of the batch, None if there was none, and the number of repairs
+    """
+    trainings = read_batch(db, after, batch_size)
+    if len(trainings) == 0:
+        return None, 0
+    embedded = {(sub["date"], sub["coach"]["chat_id"]): sub
+                for training in trainings for sub in training.get("subtrainings", [])}
+    copies = {(sub["date"], sub["coach"]["chat_id"]): sub for sub in
+              db.subtrainings.find({"date": {"$in": [training["date"] for training in trainings]}}, {"_id": 0})}
+    dates = set(date for date, coach_chat_id in set(embedded) | set(copies)
+                if embedded.get((date, coach_chat_id)) != copies.get((date, coach_chat_id)))
+    return trainings[-1]["date"], sum(reconcile_training(db, date) for date in sorted(dates))
+
+
+def verify(db: SplitDatabase, batch_size: int) -> int:
+    """Reconcile the copies of all trainings with the embedded subtrainings
+
+    :return: number of repaired subtrainings
+    """
+    after = None
+    repaired = 0
+    while True:
+        after, count = verify_batch(db, after, batch_size)
+        if after is None:
+            return repaired
+        repaired += count
+
+
+def migrate(db: SplitDatabase, batch_size: int, restart=False) -> int:
+    """Copy all subtrainings in batches. The date of the last copied
+    training is stored after every batch, an interrupted migration
+    continues there
+
+    :param db: SplitDatabase object
+    :param batch_size: number of trainings per batch
+    :param restart: ignore the stored progress
+    :return: number of copied trainings
+    """
+    migrations = db.database["migrations"]
+    checkpoint = None if restart else migrations.find_one({"_id": get_checkpoint_id(db)})
+    after = checkpoint["last_date"] if checkpoint is not None else None
+    count = 0
+    while True:
+        last_date, copied = migrate_batch(db, after, batch_size)
+        if last_date is None:
+            return count
+        migrations.update_one({"_id": get_checkpoint_id(db)}, {"$set": {"last_date": last_date}}, upsert=True)
+        count += copied
+        after = last_date
+        print("Copied subtrainings up to {}".format(last_date))
+
+
+def remove_embedded(db: SplitDatabase) -> int:
+    """Remove the embedded subtrainings once the bot runs in the split mode
+
+    :return: number of changed training documents
+    """
+    return db.trainings.update_many({"subtrainings": {"$exists": True}},
+                                    {"$unset": {"subtrainings": ""}}).modified_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, epilog="""
+    Switch the bot to "subtraining-schema": "dual" first, so new changes are written to both places.
+    Then run this script, run it with --verify until nothing is repaired, switch to "split"
+    and finally run it with --remove-embedded.""")
+    parser.add_argument("--config", default=c.CONFIG_FILE)
+    parser.add_argument("--debug", action="store_true", help="migrate the debug trainings")
+    parser.add_argument("--batch-size", type=int, default=c.MIGRATION_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="copy the missing subtrainings of all trainings again")
+    parser.add_argument("--verify", action="store_true",
+                        help="repair the copies that differ from the embedded subtrainings")
+    parser.add_argument("--remove-embedded", action="store_true",
+                        help="remove the embedded subtrainings instead of copying them")
+    args = parser.parse_args(argv)
+
+    schema = get_config(args.config).get("subtraining-schema", c.SUBTRAINING_SCHEMA)
+    db = SplitDatabase(args.config, args.debug, mode="dual")
+    if args.remove_embedded:
+        if schema != "split":
+            print("ERROR: set \"subtraining-schema\" to \"split\" and restart the bot before removing")
+            return 1
+        print("Removed the subtrainings of {} trainings".format(remove_embedded(db)))
+        return 0
+    if args.verify:
+        if schema != "dual":
+            print("ERROR: verify the copies while the bot runs with \"subtraining-schema\": \"dual\"")
+            return 1
+        repaired = verify(db, args.batch_size)
+        print("Repaired {} subtrainings".format(repaired))
+        # nonzero until a run finds no differences
+        return 0 if repaired == 0 else 2
+    if schema == "embedded":
+        print("WARNING: the bot does not write to the subtrainings collection yet, "
+              "set \"subtraining-schema\" to \"dual\" and run again with --restart afterwards")
+    print("Migration finished, copied {} trainings".format(migrate(db, args.batch_size, args.restart)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+#!/usr/bin/env bash
+
+source venv/bin/activate
+python3 benchmark.py "$@"
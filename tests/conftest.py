@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Fanout import FanoutReport  # noqa: E402
+from MemoryStorage import MemoryStorage  # noqa: E402
+
+
+class FakeNotifier:
+    """Notifier recording the messages, the chats in failing are not delivered"""
+
+    def __init__(self):
+        self.messages = []
+        self.failing = ()
+
+    def notify_many(self, messages: list) -> FanoutReport:
+        self.messages.extend(messages)
+        delivered = [chat_id not in self.failing for chat_id, _ in messages]
+        return FanoutReport(delivered, [0.0] * len(messages), 0.0, 0)
+
+
+@pytest.fixture
+def notifier():
+    return FakeNotifier()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def db(request, tmp_path):
+    if request.param == "memory":
+        db = MemoryStorage(name="test_" + request.node.name)
+    else:
+        from SqliteStorage import SqliteStorage
+        db = SqliteStorage(path=str(tmp_path / "trainings.sqlite"))
+    yield db
+    db.delete_all_trainings()
@@ -0,0 +1,66 @@
+import datetime
+import threading
+import time
+from queue import Queue
+
+from telegram import Chat, Message, Update
+from telegram.ext import TypeHandler
+
+from ChatDispatcher import ChatDispatcher
+
+
+def get_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(chat_id, Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.datetime.now(), chat))
+
+
+def start_dispatcher(callback) -> ChatDispatcher:
+    dispatcher = ChatDispatcher(None, Queue(), workers=0, chat_workers=2)
+    dispatcher.add_handler(TypeHandler(Update, callback))
+    threading.Thread(target=dispatcher.start, daemon=True).start()
+    for _ in range(100):
+        if dispatcher.running:
+            break
+        time.sleep(0.01)
+    assert dispatcher.running
+    return dispatcher
+
+
+def test_updates_of_a_chat_keep_their_order():
+    processed = []
+    lock = threading.Lock()
+
+    def record(update, context):
+        # the first updates take longest, so a parallel worker would overtake them
+        time.sleep(0.05 / update.update_id)
+        with lock:
+            processed.append((update.effective_chat.id, update.update_id, threading.current_thread().name))
+
+    dispatcher = start_dispatcher(record)
+    for update_id in range(1, 7):
+        dispatcher.process_update(get_update(update_id, 1 + update_id % 2))
+    dispatcher.stop()
+
+    for chat_id in (1, 2):
+        rows = [row for row in processed if row[0] == chat_id]
+        assert [update_id for _, update_id, _ in rows] == sorted(update_id for _, update_id, _ in rows)
+        assert len(rows) == 3
+        assert len({thread for _, _, thread in rows}) == 1
+    assert len({thread for _, _, thread in processed}) == 2
+
+
+def test_a_slow_chat_does_not_block_other_chats():
+    other_chat_done = threading.Event()
+    waited = []
+
+    def wait_for_other_chat(update, context):
+        if update.effective_chat.id == 1:
+            waited.append(other_chat_done.wait(5))
+        else:
+            other_chat_done.set()
+
+    dispatcher = start_dispatcher(wait_for_other_chat)
+    dispatcher.process_update(get_update(1, 1))
+    dispatcher.process_update(get_update(2, 2))
+    dispatcher.stop()
+    assert waited == [True]
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from Fanout import Fanout, RateLimiter
+
+
+class FakeSender:
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, message: str, chat_id):
+        with self.lock:
+            self.sent.append((chat_id, time.monotonic()))
+
+    def get_gaps(self, chat_id) -> list:
+        times = sorted(sent_at for sent_chat_id, sent_at in self.sent if sent_chat_id == chat_id)
+        return [b - a for a, b in zip(times, times[1:])]
+
+
+def test_fanouts_sharing_a_limiter_keep_the_chat_rate():
+    sender = FakeSender()
+    limiter = RateLimiter(global_rate=1000, chat_rate=10)
+    for _ in range(3):
+        report = Fanout(sender.send, workers=4, limiter=limiter).run([(1, "a"), (2, "b")])
+        assert report.get_sent() == 2
+    # a new limiter per run would send the first message of every run at once
+    assert min(sender.get_gaps(1)) >= 0.09
+    assert min(sender.get_gaps(2)) >= 0.09
+
+
+def test_concurrent_fanouts_share_the_global_rate():
+    sender = FakeSender()
+    limiter = RateLimiter(global_rate=20, chat_rate=1000)
+    runs = [threading.Thread(target=Fanout(sender.send, workers=4, limiter=limiter).run,
+                             args=([(chat_id, "a") for chat_id in range(run * 15, run * 15 + 15)],))
+            for run in range(2)]
+    start = time.monotonic()
+    for run in runs:
+        run.start()
+    for run in runs:
+        run.join()
+    assert len(sender.sent) == 30
+    # the burst of 20 messages is shared, the last 10 wait for new tokens
+    assert max(sent_at for _, sent_at in sender.sent) - start >= 0.45
+
+
+def test_prune_drops_idle_chat_buckets():
+    limiter = RateLimiter(chat_rate=10)
+    limiter.acquire(1)
+    limiter.acquire(2)
+    limiter.prune(idle=60)
+    assert set(limiter.chat_buckets) == {1, 2}
+    time.sleep(0.05)
+    limiter.acquire(2)
+    limiter.prune(idle=0.04)
+    assert set(limiter.chat_buckets) == {2}
@@ -0,0 +1,98 @@
+import datetime
+
+from benchmark import get_user_dict
+import constants as c
+import continuous_task
+from MemoryStorage import MemoryStorage
+from Training import Training
+from User import User
+
+
+def add_training(db, date: int, coach_chat_id: int, chat_ids: list):
+    db._insert_training({"date": date, "time": "18:00", "attendees": [], "link": "l",
+                         "subtrainings": [{"date": date, "coach": get_user_dict(coach_chat_id, c.COACH),
+                                           "title": "T", "description": "", "time": "18:00", "link": "l",
+                                           "attendees": [get_user_dict(i, c.ATTENDEE) for i in chat_ids]}]})
+
+
+def test_due_reminders_are_sent_once(db, notifier):
+    now = datetime.datetime.now()
+    soon = int((now + datetime.timedelta(hours=2)).timestamp())
+    later = int((now + datetime.timedelta(days=30)).timestamp())
+    add_training(db, soon, 1, [2, 3])
+    add_training(db, later, 1, [2])
+    db.rebuild_notification_ledger()
+
+    report = continuous_task.notify_due_trainings(db, notifier)
+    assert report.get_sent() == 3
+    assert sorted(chat_id for chat_id, _ in notifier.messages) == [1, 2, 3]
+    assert continuous_task.notify_due_trainings(db, notifier) is None
+
+
+def test_coach_attending_another_subtraining_keeps_own_reminders(db):
+    day = datetime.date.today() + datetime.timedelta(days=3)
+    db.add_training(day, "18:00")
+    date = int(db.next_trainings(1)[0]["date"].timestamp())
+    coach1, coach2 = User(from_dict=get_user_dict(1, c.COACH)), User(from_dict=get_user_dict(2, c.COACH))
+    for coach in (coach1, coach2):
+        assert db.add_subtraining(Training(coach=coach, date=datetime.datetime.fromtimestamp(date), title="T"))
+    db.subtraining_add_attendee(coach1, date, coach2)
+    now = date - c.NEXT_TRAINING_NOTIFY_FAR.total_seconds()
+    rows = [(row["chat_id"], row["role"], row["coach_chat_id"], row["kind"]) for row in db.due_notifications(now)]
+    assert (1, c.COACH, 1, "far") in rows
+    assert (1, c.ATTENDEE, 2, "far") in rows
+
+    db.cancel_subtrainings(date, coach1)
+    rows = [(row["chat_id"], row["role"], row["coach_chat_id"]) for row in db.due_notifications(now)]
+    assert sorted(rows) == [(1, c.COACH, 1), (2, c.COACH, 2)]
+    assert len(db.get_my_trainings(coach1, c.COACH)) == 1
+
+
+def test_failed_reminders_are_released(db, notifier):
+    soon = int((datetime.datetime.now() + datetime.timedelta(hours=2)).timestamp())
+    add_training(db, soon, 1, [2, 3])
+    db.rebuild_notification_ledger()
+
+    notifier.failing = [3]
+    assert continuous_task.notify_due_trainings(db, notifier).get_failed() == 1
+    notifier.failing = ()
+    assert continuous_task.notify_due_trainings(db, notifier).get_sent() == 1
+    assert [chat_id for chat_id, _ in notifier.messages] == [1, 2, 3, 3]
+    assert db.claim_due_notifications() == []
+
+
+class FakeJob:
+    def __init__(self, callback, when: float):
+        self.callback = callback
+        self.when = when
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when: float, name=None) -> FakeJob:
+        self.jobs.append(FakeJob(callback, when))
+        return self.jobs[-1]
+
+    def get_pending(self) -> list:
+        return [job for job in self.jobs if not job.removed]
+
+
+def test_poke_during_a_run_schedules_another_run(notifier):
+    db = MemoryStorage(name="test_scheduler")
+    job_queue = FakeJobQueue()
+    scheduler = continuous_task.NotificationScheduler(job_queue, db, notifier)
+    scheduler.start()
+    [job] = job_queue.get_pending()
+    # a sign-up while the job runs
+    db.claim_due_notifications = lambda now=None: scheduler.poke() or []
+    job.callback()
+    # run_once jobs are gone after they ran
+    job.removed = True
+    [job] = job_queue.get_pending()
+    assert job.when == c.NOTIFICATION_FREQUENCY_SECONDS
@@ -0,0 +1,70 @@
+import datetime
+
+import constants as c
+from Outbox import OutboxSender
+
+
+def record_retries(db) -> list:
+    retries = []
+    retry = db._outbox_retry
+
+    def record(row_id, attempts: int, next_attempt_at: float):
+        retries.append((row_id, attempts, next_attempt_at - datetime.datetime.now().timestamp()))
+        retry(row_id, attempts, next_attempt_at)
+    db._outbox_retry = record
+    return retries
+
+
+def get_backoffs(retries: list) -> list:
+    # attempts and delay of the retries of the sender, without those of make_due
+    return [(attempts, delay) for _, attempts, delay in retries if delay > 0]
+
+
+def make_due(db, retries: list):
+    # skip the backoff instead of waiting for it
+    row_id, attempts, _ = retries[-1]
+    db._outbox_retry(row_id, attempts, 0)
+
+
+def test_delivered_messages_leave_the_outbox(db, notifier):
+    db.enqueue_messages([(1, "a"), (2, "b")])
+    sender = OutboxSender(None, db, notifier)
+    assert sender.drain() == 2
+    assert notifier.messages == [(1, "a"), (2, "b")]
+    assert sender.drain() == 0
+
+
+def test_failed_messages_are_retried_with_backoff(db, notifier):
+    retries = record_retries(db)
+    notifier.failing = [1]
+    db.enqueue_messages([(1, "a"), (2, "b")])
+    sender = OutboxSender(None, db, notifier)
+    assert sender.drain() == 2
+    # the backoff hides the failed message until its next attempt
+    assert sender.drain() == 0
+    make_due(db, retries)
+    assert sender.drain() == 1
+    (first, first_delay), (second, second_delay) = get_backoffs(retries)
+    assert (first, second) == (1, 2)
+    assert abs(first_delay - c.OUTBOX_RETRY_SECONDS) < 5
+    assert abs(second_delay - 2 * c.OUTBOX_RETRY_SECONDS) < 5
+
+    notifier.failing = ()
+    make_due(db, retries)
+    assert sender.drain() == 1
+    assert notifier.messages[-1] == (1, "a")
+    assert sender.drain() == 0
+
+
+def test_messages_are_dropped_after_the_last_attempt(db, notifier):
+    retries = record_retries(db)
+    notifier.failing = [1]
+    db.enqueue_messages([(1, "a")])
+    sender = OutboxSender(None, db, notifier)
+    for _ in range(1, c.OUTBOX_MAX_ATTEMPTS):
+        assert sender.drain() == 1
+        make_due(db, retries)
+    assert sender.drain() == 1
+    assert sender.drain() == 0
+    assert [attempts for attempts, _ in get_backoffs(retries)] == list(range(1, c.OUTBOX_MAX_ATTEMPTS))
+    assert len(notifier.messages) == c.OUTBOX_MAX_ATTEMPTS
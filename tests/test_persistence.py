@@ -0,0 +1,43 @@
+import datetime
+
+from benchmark import get_user_dict
+import constants as c
+from SqlitePersistence import SqlitePersistence
+from Training import Training
+from User import User
+
+
+def test_flushed_state_is_restored(tmp_path):
+    path = str(tmp_path / "persistence.sqlite")
+    persistence = SqlitePersistence(path)
+    date = datetime.datetime(2030, 1, 7, 18, 0)
+    training = Training(coach=User(from_dict=get_user_dict(1, c.COACH)), date=date, title="T")
+    training.possible_dates = [date]
+    persistence.update_user_data(1, {"training": training, "step": 2})
+    persistence.update_conversation("add", (1, 1), 3)
+    persistence.update_conversation("cancel", (2, 2), 1)
+    persistence.flush()
+    persistence.update_conversation("cancel", (2, 2), None)
+    persistence.update_conversation("add", (3, 3), 1)
+    persistence.flush()
+    # not flushed, lost like on a crash
+    persistence.update_user_data(2, {"step": 1})
+
+    restored = SqlitePersistence(path)
+    assert restored.get_conversations("add") == {(1, 1): 3, (3, 3): 1}
+    assert restored.get_conversations("cancel") == {}
+    user_data = restored.get_user_data()
+    assert set(user_data) == {1}
+    assert user_data[1]["step"] == 2
+    assert user_data[1]["training"].get_state() == training.get_state()
+    assert user_data[1]["training"].coach.chat_id == 1
+
+
+def test_drafts_are_stored_as_they_were_when_updated(tmp_path):
+    path = str(tmp_path / "persistence.sqlite")
+    persistence = SqlitePersistence(path)
+    training = Training(coach=User(from_dict=get_user_dict(1, c.COACH)), title="T")
+    persistence.update_user_data(1, {"training": training})
+    training.title = "changed after the update"
+    persistence.flush()
+    assert SqlitePersistence(path).get_user_data()[1]["training"].title == "T"
@@ -0,0 +1,72 @@
+import json
+import threading
+
+import pytest
+
+import constants as c
+import Storage
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"storage-backend": "memory",
+                                "num_trainings": 21,
+                                "trainings": [{"weekday": 0, "time": "18:00"}, {"weekday": 3, "time": "19:30"}]}))
+    yield str(path)
+    Storage._storages.pop((str(path), "memory", True), None)
+
+
+def open_storage_with_timeout(config_file):
+    # a deadlock must fail the test instead of hanging the run
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(db=Storage.open_storage(config_file, debug_mode=True)),
+                              daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "open_storage did not return"
+    return result["db"]
+
+
+def test_open_storage_is_shared(config_file):
+    db = open_storage_with_timeout(config_file)
+    assert open_storage_with_timeout(config_file) is db
+
+
+def test_create_trainings_twice(config_file):
+    db = open_storage_with_timeout(config_file)
+    db.delete_all_trainings()
+    created = db.create_trainings(21)
+    assert created == 6
+    assert db.create_trainings(21) == 0
+    assert len(db.next_trainings(all=True)) <= created
+    db.delete_all_trainings()
+
+
+def test_cache_skips_trainings_read_before_a_write():
+    cache = Storage.TrainingCache(ttl=60)
+    generation = cache.get_generation()
+    assert cache.get(1) is None
+    # a write finishes while the miss reads the old trainings
+    cache.invalidate(1234)
+    cache.put(1, [], generation)
+    assert cache.get(1) is None
+    generation = cache.get_generation()
+    cache.put(1, [], generation)
+    assert cache.get(1) == []
+
+
+def test_sqlite_import_is_one_transaction(config_file, tmp_path):
+    from SqliteStorage import SqliteStorage
+    db = SqliteStorage(config_file, path=str(tmp_path / "trainings.sqlite"))
+    coach = {"chat_id": 1, "user_name": "c", "full_name": "Coach", "notified_far": False, "notified_now": False,
+             "role": c.COACH}
+    training = {"date": 1000, "time": "18:00", "link": "l", "attendees": [],
+                "subtrainings": [{"date": 1000, "coach": coach, "title": "T", "description": "", "time": "18:00",
+                                  "link": "l", "attendees": []}]}
+    # the second training misses its time, the whole batch must be rolled back
+    with pytest.raises(KeyError):
+        db.import_trainings([training, {"date": 2000, "link": "l", "attendees": []}])
+    assert list(db.iter_trainings()) == []
+    assert db.import_trainings([training]) == 1
+    assert [len(tr["subtrainings"]) for tr in db.iter_trainings()] == [1]
@@ -1,7 +1,8 @@
 import datetime
 import random
 import string
-import json
+import threading
+from collections import OrderedDict
 from typing import Tuple, List
 
 from telegram import ReplyKeyboardMarkup, Update
@@ -9,16 +10,18 @@ from telegram.ext import CallbackContext
 
 import Training
 import constants as c
+from Config import get_config
+
+# rendered text by key: (version, text), shared by all chats
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
 
 
 def get_channel_id():
     """
     Get the telegram channel id from the config file
     """
-    with open(c.CONFIG_FILE) as config_file:
-        db_conf = json.load(config_file)
-        
-    return db_conf[c.CHANNEL_KEY] if c.CHANNEL_KEY in db_conf.keys() else None
+    return get_config().get_channel_id()
 
 
 def action_selector(update: Update, context: CallbackContext):
@@ -64,11 +67,38 @@ def get_training(context: CallbackContext):
 
 def get_db(context: CallbackContext):
     """
-    Get the database object from the chat context.
+    Get the database object. It is shared by all chats and not part of the chat context,
+    which only holds state that can be persisted.
+    :param context: Chat bot context
+    :return: Storage object
+    """
+    # imported here, Storage itself depends on this module
+    from Storage import open_storage
+    return open_storage(c.CONFIG_FILE, debug_mode=c.DEBUG_MODE)
+
+
+def poke_scheduler(context: CallbackContext):
+    """
+    Tell the notification scheduler, if the bot runs one, that trainings changed.
+    :param context: Chat bot context
+    """
+    scheduler = context.bot_data.get("scheduler")
+    if scheduler is not None:
+        scheduler.poke()
+
+
+def send_later(context: CallbackContext, messages: list):
+    """
+    Put messages into the outbox, the outbox sender delivers them in the background.
     :param context: Chat bot context
-    :return: Database object
+    :param messages: List of (chat_id, message) tuples
     """
-    return context.user_data["db"]
+    if len(messages) == 0:
+        return
+    get_db(context).enqueue_messages(messages)
+    outbox = context.bot_data.get("outbox")
+    if outbox is not None:
+        outbox.poke()
 
 
 def parse_bot_date(update: Update, training: Training, curr_state: int) -> int:
@@ -89,6 +119,30 @@ def parse_bot_date(update: Update, training: Training, curr_state: int) -> int:
     training.set_date(training.get_possible_dates()[date_idx])
 
 
+def get_fragment(key, version, render):
+    """
+    Get a rendered piece of text from the cache, render it if it is missing or its version changed.
+    :param key: Hashable key of the text, e.g. kind, training date and coach chat id
+    :param version: Version of the rendered data, see Storage.get_version. None disables the cache
+    :param render: Function without arguments returning the text
+    :return: The rendered text
+    """
+    if version is None:
+        return render()
+    with _fragments_lock:
+        entry = _fragments.get(key)
+        if entry is not None and entry[0] == version:
+            _fragments.move_to_end(key)
+            return entry[1]
+    text = render()
+    with _fragments_lock:
+        _fragments[key] = (version, text)
+        _fragments.move_to_end(key)
+        while len(_fragments) > c.FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return text
+
+
 def get_readable_date_from_datetime(date: datetime) -> str:
     """
     Print a datetime object to a readable format
@@ -107,21 +161,28 @@ def get_training_list(trainings: list, with_commands=False, with_attendees=False
     :param with_attendees: If true, also get a list of attendees of the training
     :return: The formatted text and a list of commands
     """
-    msg = ""
+    def render(t):
+        body = "{}\nAnzahl Teilnehmer: {}".format(t.get_title().replace("\n", " "), t.get_attendee_count())
+        if with_attendees and t.get_attendee_count() > 0:
+            body += "\nTeilnehmer: {}".format(", ".join([i.get_full_name() for i in t.get_attendees()]))
+        return body + "\n\n"
+
+    parts = []
     commands = []
     for idx, t in enumerate(trainings):
-        msg += "*{}. Training am {}*\n".format(idx + 1, t.get_date(c.DATE_FORMAT))
+        date = int(t.get_dict()["date"])
+        parts.append("*{}. Training am {}*\n".format(
+            idx + 1, get_fragment(("date", date), 0, lambda: t.get_date(c.DATE_FORMAT))))
         if with_commands:
             command = "/{}_{}".format(c.CMD_TRAINING, idx + 1)
-            msg += command + ": "
+            parts.append(command + ": ")
             commands.append([command])
         else:
-            msg += "Titel: "
-        msg += "{}".format(t.get_title().replace("\n", " "))
-        msg += "\nAnzahl Teilnehmer: {}".format(len(t.get_attendees()))
-        if with_attendees and len(t.get_attendees()) > 0:
-            msg += "\nTeilnehmer: {}".format(", ".join([i.get_full_name() for i in t.get_attendees()]))
-        msg += "\n\n"
+            parts.append("Titel: ")
+        # the subtraining of a coach is rendered once for all users until it changes
+        parts.append(get_fragment(("list", date, t.get_coach().get_chat_id(), with_attendees), t.get_version(),
+                                  lambda: render(t)))
+    msg = "".join(parts)
     if with_commands:
         return msg, commands
     else: